@@ -0,0 +1,103 @@
+"""Размер и время ответа JSON API против тех же HTML-страниц.
+
+Скрипт создаёт временную тестовую базу с постами и комментариями и
+запрашивает через тестовый клиент первую страницу ленты, группы,
+профиля и страницу поста в обоих видах. Каждая страница меряется
+холодной (кеш очищен перед каждым запросом) и тёплой, а JSON - ещё и
+с ?fields=id,text.
+
+Запуск из корня проекта:
+
+    python benchmarks/api_vs_html.py --posts 2000 --repeat 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from posts.models import Comment, Group, Post, User  # noqa: E402
+
+
+def populate(posts, comments):
+    author = User.objects.create(username="author")
+    group = Group.objects.create(title="group", slug="group",
+                                 description="group")
+    Post.objects.bulk_create(
+        [Post(text=f"post {i} " + "lorem ipsum " * 20, author=author,
+              group=group) for i in range(posts)])
+    post = Post.objects.order_by("-pk").first()
+    for i in range(comments):
+        Comment.objects.create(text=f"comment {i}", post=post, author=author)
+    return author, group, post
+
+
+def timed(client, url, params, repeat, cold):
+    samples = []
+    for _ in range(repeat):
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        response = client.get(url, params)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return statistics.median(samples), len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        author, group, post = populate(args.posts, args.comments)
+        pages = {
+            "index": (reverse("index"), reverse("api_index")),
+            "group": (reverse("groups", kwargs={"slug": group.slug}),
+                      reverse("api_group", kwargs={"slug": group.slug})),
+            "profile": (
+                reverse("profile", kwargs={"username": author.username}),
+                reverse("api_profile", kwargs={"username": author.username})),
+            "post": (
+                reverse("post", kwargs={"username": author.username,
+                                        "post_id": post.pk}),
+                reverse("api_post", kwargs={"post_id": post.pk})),
+        }
+        variants = (("html", 0, {}), ("json", 1, {}),
+                    ("json fields", 1, {"fields": "id,text"}))
+        client = Client()
+
+        print(f"{'page':<9}{'format':<13}{'bytes':>9}{'cold ms':>10}"
+              f"{'warm ms':>10}")
+        for name, urls in pages.items():
+            for variant, index, params in variants:
+                cold_ms, size = timed(client, urls[index], params,
+                                      args.repeat, cold=True)
+                warm_ms, _ = timed(client, urls[index], params,
+                                   args.repeat, cold=False)
+                print(f"{name:<9}{variant:<13}{size:>9}{cold_ms:>10.2f}"
+                      f"{warm_ms:>10.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
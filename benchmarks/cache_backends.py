@@ -0,0 +1,79 @@
+"""Задержка попаданий в кеш: LocMemCache против общего SQLiteCache.
+
+Меряются операции, которые делают ленты: get карточки, get_many всех
+карточек страницы, set_many промахов и incr версии пространства имён.
+
+Запуск из корня проекта:
+
+    python benchmarks/cache_backends.py --repeat 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache.backends.locmem import LocMemCache  # noqa: E402
+
+from yatube.sqlite_cache import SQLiteCache  # noqa: E402
+
+CARD = "<div class=\"card\">" + "x" * 2000 + "</div>"
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99)]
+
+
+def measure(cache, repeat):
+    keys = [f"card:{pk}:0" for pk in range(10)]
+    cache.set_many({key: CARD for key in keys}, 300)
+    cache.set("ns:feed:index", 1, None)
+    return {
+        "get": timed(lambda: cache.get(keys[0]), repeat),
+        "get_many(10)": timed(lambda: cache.get_many(keys), repeat),
+        "set_many(10)": timed(
+            lambda: cache.set_many({key: CARD for key in keys}, 300),
+            repeat // 10),
+        "incr": timed(lambda: cache.incr("ns:feed:index"), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5000)
+    args = parser.parse_args()
+
+    location = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+    backends = {
+        "locmem": LocMemCache("bench", {"OPTIONS": {"MAX_ENTRIES": 10000}}),
+        "sqlite": SQLiteCache(location, {"OPTIONS": {"MAX_ENTRIES": 10000}}),
+    }
+    results = {name: measure(cache, args.repeat)
+               for name, cache in backends.items()}
+
+    print(f"{'operation':<14}" + "".join(
+        f"{name + ' p50/p99 us':>24}" for name in backends))
+    for operation in results["locmem"]:
+        row = "".join(f"{results[name][operation][0]:>14.1f}"
+                      f"{results[name][operation][1]:>10.1f}"
+                      for name in backends)
+        print(f"{operation:<14}{row}")
+
+
+if __name__ == "__main__":
+    main()
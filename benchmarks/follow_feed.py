@@ -0,0 +1,129 @@
+"""Сравнение ленты подписок: чистый pull, рассылка (push) и гибрид.
+
+Скрипт создаёт временную тестовую базу, подписывает читателей на
+обычных авторов и на одного автора с большим числом подписчиков и
+измеряет:
+
+* сколько записей TimelineEntry пишется на один новый пост (write
+  amplification);
+* время чтения первой страницы ленты подписок.
+
+Запуск из корня проекта:
+
+    python benchmarks/follow_feed.py --readers 2000 --authors 40
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from unittest import mock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models.signals import post_save  # noqa: E402
+
+from posts import signals, stats, timeline  # noqa: E402
+from posts.models import Follow, Post, TimelineEntry, User  # noqa: E402
+
+
+def populate(readers, authors, posts_per_author):
+    # наполняем базу в обход сигналов: ленты заполним отдельно
+    post_save.disconnect(signals.post_saved, sender=Post)
+    post_save.disconnect(signals.follow_saved, sender=Follow)
+    try:
+        User.objects.bulk_create(
+            [User(username=f"reader{i}") for i in range(readers)])
+        User.objects.bulk_create(
+            [User(username=f"author{i}") for i in range(authors)])
+        star = User.objects.create(username="star")
+        users = list(User.objects.filter(username__startswith="reader"))
+        writers = list(User.objects.filter(username__startswith="author"))
+        Post.objects.bulk_create(
+            [Post(text=f"post {i}", author=author)
+             for author in writers + [star]
+             for i in range(posts_per_author)])
+        # каждый читатель подписан на 10 обычных авторов и на звезду
+        Follow.objects.bulk_create(
+            [Follow(user=user, author=author)
+             for i, user in enumerate(users)
+             for author in [writers[(i + k) % len(writers)]
+                            for k in range(10)] + [star]])
+    finally:
+        post_save.connect(signals.post_saved, sender=Post)
+        post_save.connect(signals.follow_saved, sender=Follow)
+    # счётчики подписчиков пишут отключённые сигналы, а по ним гибрид
+    # выбирает авторов, которых читают напрямую
+    stats.rebuild()
+    for follow in Follow.objects.all():
+        timeline.backfill(follow.user_id, follow.author_id)
+    return users[0], writers[0], star
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def write_amplification(author):
+    before = TimelineEntry.objects.count()
+    Post.objects.create(text="fresh", author=author)
+    return TimelineEntry.objects.count() - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=2000)
+    parser.add_argument("--authors", type=int, default=40)
+    parser.add_argument("--posts", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        reader, writer, star = populate(args.readers, args.authors,
+                                        args.posts)
+
+        def pull_page():
+            list(Post.objects.select_related("author")
+                 .filter(author__following__user=reader)[:10])
+
+        def feed_page():
+            list(timeline.timeline_posts(reader)[:10])
+
+        results = []
+        for mode, limit in (("push", args.readers * 10),
+                            ("hybrid", args.readers - 1)):
+            with mock.patch.object(timeline, "FANOUT_FOLLOWER_LIMIT", limit):
+                cache.delete(timeline.PULL_AUTHORS_CACHE_KEY)
+                results.append((mode,
+                                write_amplification(writer),
+                                write_amplification(star),
+                                timed(feed_page, args.repeat)))
+        cache.delete(timeline.PULL_AUTHORS_CACHE_KEY)
+        # в гибриде пост звезды не рассылается, иначе замер не тот
+        assert results[1][2] == 0, results[1]
+        results.insert(0, ("pull", 0, 0, timed(pull_page, args.repeat)))
+
+        print(f"{'mode':<8}{'rows/post':>12}{'rows/star post':>16}"
+              f"{'read ms':>10}")
+        for mode, rows, star_rows, read_ms in results:
+            print(f"{mode:<8}{rows:>12}{star_rows:>16}{read_ms:>10.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,119 @@
 from django.contrib import admin
 
 # Register your models here.
+from . import bulk, search
+from .api import ID_RE
 from .models import Post, Group, Comment, Follow
+from .pagination import ApproximatePaginator
 
 
-class PostAdmin(admin.ModelAdmin):
-    list_display = ("pk", "text", "pub_date", "author", "group")
-    search_fields = ("text",)
-    list_filter = ("pub_date", "group",)
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр с полем ввода вместо списка всех значений.
+
+    Стандартный фильтр по внешнему ключу выводит по ссылке на каждого
+    пользователя или пост, то есть читает всю таблицу.
+    """
+    template = "admin/input_filter.html"
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            "query_string": changelist.get_query_string(
+                remove=[self.parameter_name]),
+            "query_parts": [(name, value)
+                            for name, value in changelist.params.items()
+                            if name != self.parameter_name],
+        }
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        return queryset.filter(**{self.lookup: value.strip()})
+
+
+class AuthorFilter(InputFilter):
+    title = "автор"
+    parameter_name = "author"
+    lookup = "author__username"
+
+
+class UserFilter(InputFilter):
+    title = "подписчик"
+    parameter_name = "user"
+    lookup = "user__username"
+
+
+class PostFilter(InputFilter):
+    title = "пост"
+    parameter_name = "post"
+    lookup = "post_id"
+
+    def queryset(self, request, queryset):
+        if self.value() and not ID_RE.match(self.value().strip()):
+            return queryset.none()
+        return super().queryset(request, queryset)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Список, который не читает таблицу целиком: примерное число строк
+    и массовое удаление пачками в фоне вместо delete_selected."""
+    paginator = ApproximatePaginator
+    show_full_result_count = False
+    actions = ["delete_in_background"]
     empty_value_display = '-пусто-'
 
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # delete_selected собирает все связанные объекты для страницы
+        # подтверждения и удаляет их одной транзакцией
+        actions.pop("delete_selected", None)
+        return actions
+
+    def delete_in_background(self, request, queryset):
+        # в очередь уходят ключи, а не queryset: задача живёт в базе
+        model = queryset.model._meta.label
+        ids = list(queryset.order_by().values_list("pk", flat=True))
+        bulk.schedule(bulk.delete_in_batches, model, {"pk__in": ids})
+        self.message_user(request, "Выбранные записи удаляются в фоне")
+    delete_in_background.short_description = "Удалить выбранные (в фоне)"
+
+
+class PostAdmin(ScalableAdmin):
+    list_display = ("pk", "text", "pub_date", "author", "group",
+                    "comment_count")
+    list_select_related = ("author", "group")
+    search_fields = ("text",)
+    list_filter = ("pub_date", "group", AuthorFilter)
+    date_hierarchy = "pub_date"
+    autocomplete_fields = ("author", "group")
+    actions = ["delete_in_background", "delete_author_posts"]
+    # сколько найденных постов показывать в поиске админки
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        # вместо LIKE '%...%' по всей таблице - полнотекстовый индекс
+        if not search_term:
+            return queryset, False
+        ids = search.search(search_term).ids(0, self.search_limit)
+        return queryset.filter(pk__in=ids), False
+
+    def delete_author_posts(self, request, queryset):
+        author_ids = list(queryset.order_by().values_list("author_id", flat=True)
+                          .distinct())
+        bulk.schedule(bulk.delete_in_batches, Post._meta.label,
+                      {"author_id__in": author_ids})
+        self.message_user(request, f"Все посты авторов ({len(author_ids)}) "
+                                   f"удаляются в фоне")
+    delete_author_posts.short_description = \
+        "Удалить все посты авторов выбранных постов (в фоне)"
+
 
 admin.site.register(Post, PostAdmin)
 
@@ -24,21 +128,26 @@ class GroupAdmin(admin.ModelAdmin):
 admin.site.register(Group, GroupAdmin)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdmin):
     list_display = ("pk", "text", "created", "author", "post")
-    search_fields = ("text",)
-    list_filter = ("created", "author", "post",)
-    empty_value_display = '-пусто-'
+    list_select_related = ("author", "post")
+    # текст комментариев не индексирован, ищем по точному имени автора
+    search_fields = ("=author__username",)
+    list_filter = ("created", AuthorFilter, PostFilter)
+    date_hierarchy = "created"
+    autocomplete_fields = ("author",)
+    raw_id_fields = ("post",)
 
 
 admin.site.register(Comment, CommentAdmin)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = ("pk", "user", "author")
-    search_fields = ("user",)
-    list_filter = ("user", "author",)
-    empty_value_display = '-пусто-'
+    list_select_related = ("user", "author")
+    search_fields = ("=user__username", "=author__username")
+    list_filter = (UserFilter, AuthorFilter)
+    autocomplete_fields = ("user", "author")
 
 
 admin.site.register(Follow, FollowAdmin)
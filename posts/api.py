@@ -0,0 +1,390 @@
+"""JSON API лент, постов и комментариев только для чтения.
+
+Строки выбираются через values() и сериализуются без создания моделей.
+Параметр ?fields=id,text оставляет в ответе только нужные поля, и в
+SELECT попадают только они (и JOIN автора или группы - только если их
+запросили). Ленты листаются курсором ?after=, как HTML-ленты, и
+отвечают на условные запросы: ETag и Last-Modified строятся по тем же
+строкам, что и сам ответ.
+
+Пакетные эндпоинты отдают до BATCH_LIMIT постов или пользователей за
+запрос из кеша отдельных объектов (posts.object_cache).
+
+Эндпоинты "since" отдают только то, что появилось после курсора клиента:
+один диапазон индекса вместо всей страницы, а если нового нет - пустой
+ответ 204.
+"""
+import hashlib
+import re
+
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import condition
+
+from . import object_cache
+from .comments import COMMENTS_PER_PAGE, comments_after
+from .models import Comment, Group, Post, User
+from .pagination import (POSTS_PER_PAGE, CursorPaginator, decode_cursor,
+                         encode_cursor)
+from .timeline import timeline_posts
+
+SINCE_LIMIT = 100
+BATCH_LIMIT = 300
+# допустимые имена пользователей (UnicodeUsernameValidator)
+USERNAME_RE = re.compile(r"^[\w.@+-]+\Z")
+# str.isdigit() пропускает "²" и другие цифры, которые не разберёт int()
+ID_RE = re.compile(r"^[0-9]+\Z")
+
+# имя поля в ответе -> поле для values()
+POST_FIELDS = {
+    "id": "pk",
+    "author": "author__username",
+    "group": "group__slug",
+    "text": "text",
+    "pub_date": "pub_date",
+    "image": "image",
+    "comment_count": "comment_count",
+}
+USER_FIELDS = {
+    "id": "pk",
+    "username": "username",
+    "first_name": "first_name",
+    "last_name": "last_name",
+    "followers": "stats__followers",
+    "following": "stats__following",
+    "posts": "stats__posts",
+}
+COMMENT_FIELDS = {
+    "id": "pk",
+    "author": "author__username",
+    "text": "text",
+    "created": "created",
+}
+
+image_storage = Post._meta.get_field("image").storage
+
+
+def _value(name, value):
+    if name in ("pub_date", "created"):
+        return value.isoformat()
+    if name == "image":
+        return image_storage.url(value) if value else None
+    return value
+
+
+def serialize(rows, fields):
+    """Строки values() -> словари ответа с полями fields."""
+    return [{name: _value(name, row[lookup])
+             for name, lookup in fields.items()} for row in rows]
+
+
+def requested_fields(request, fields):
+    """Поля из ?fields=, по умолчанию все; None - если есть неизвестные."""
+    names = [name.strip()
+             for name in request.GET.get("fields", "").split(",")
+             if name.strip()]
+    if not names:
+        return fields
+    if any(name not in fields for name in names):
+        return None
+    return {name: fields[name] for name in names}
+
+
+def post_values(post_list, fields=POST_FIELDS):
+    return post_list.values("pk", "pub_date", *fields.values())
+
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _error(detail, status):
+    return JsonResponse({"detail": detail}, status=status)
+
+
+def _no_content():
+    return HttpResponse(status=204)
+
+
+def feed_page(request, post_list):
+    """Страница ленты после курсора ?after= для ответа и condition().
+
+    Вместе с запрошенными полями выбирается modified: по нему и id
+    строк считаются ETag и Last-Modified, так что и проверка условного
+    запроса, и сам ответ обходятся одним запросом к постам. Результат
+    запоминается на запросе; None - неверные ?fields=, ?after= или
+    лента, которой у зрителя нет.
+    """
+    if not hasattr(request, "_api_page"):
+        fields = requested_fields(request, POST_FIELDS)
+        token = request.GET.get("after", "")
+        after = decode_cursor(token) if token else None
+        if post_list is None or fields is None or (token and after is None):
+            request._api_page = None
+            return None
+        paginator = CursorPaginator(
+            post_list.values("pk", "pub_date", "modified", *fields.values()),
+            POSTS_PER_PAGE)
+        page = paginator.get_page(after=after)
+        rows = page.object_list
+        last_modified = max((row["modified"] for row in rows), default=None)
+        next_cursor = None
+        if page.has_next():
+            next_cursor = encode_cursor(rows[-1]["pub_date"], rows[-1]["pk"])
+        request._api_page = {
+            "rows": rows,
+            "fields": fields,
+            "next": next_cursor,
+            "etag": _etag(request.path, list(fields), token,
+                          [row["pk"] for row in rows], last_modified),
+            "last_modified": last_modified,
+        }
+    return request._api_page
+
+
+def feed_condition(feed):
+    """condition() для ленты; feed(request, *args) возвращает посты."""
+    def etag(request, *args, **kwargs):
+        page = feed_page(request, feed(request, *args, **kwargs))
+        return page and page["etag"]
+
+    def last_modified(request, *args, **kwargs):
+        page = feed_page(request, feed(request, *args, **kwargs))
+        return page and page["last_modified"]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _feed_response(request, post_list, exists=None):
+    page = feed_page(request, post_list)
+    if page is None:
+        return _error("Неверный параметр ?fields= или ?after=", 400)
+    # пустая страница - возможно, ленты нет вовсе
+    if not page["rows"] and exists is not None and not exists():
+        return _error("Не найдено", 404)
+    return JsonResponse({"posts": serialize(page["rows"], page["fields"]),
+                         "next": page["next"]})
+
+
+def _index_feed(request):
+    return Post.objects.all()
+
+
+def _group_feed(request, slug):
+    return Post.objects.filter(group__slug=slug)
+
+
+def _profile_feed(request, username):
+    return Post.objects.filter(author__username=username)
+
+
+def _follow_feed(request):
+    if not request.user.is_authenticated:
+        return None
+    if not hasattr(request, "_timeline"):
+        request._timeline = timeline_posts(request.user)
+    return request._timeline
+
+
+@feed_condition(_index_feed)
+def index(request):
+    return _feed_response(request, _index_feed(request))
+
+
+@feed_condition(_group_feed)
+def group_posts(request, slug):
+    return _feed_response(
+        request, _group_feed(request, slug),
+        lambda: Group.objects.filter(slug=slug).exists())
+
+
+@feed_condition(_profile_feed)
+def profile(request, username):
+    return _feed_response(
+        request, _profile_feed(request, username),
+        lambda: User.objects.filter(username=username).exists())
+
+
+@feed_condition(_follow_feed)
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _error("Нужна авторизация", 401)
+    return _feed_response(request, _follow_feed(request))
+
+
+def _post_row(request, post_id):
+    if not hasattr(request, "_api_post"):
+        fields = requested_fields(request, POST_FIELDS)
+        row = None
+        if fields is not None:
+            row = Post.objects.filter(pk=post_id) \
+                .values("modified", *fields.values()).first()
+        request._api_post = fields, row
+    return request._api_post
+
+
+def _post_etag(request, post_id):
+    fields, row = _post_row(request, post_id)
+    if row is None:
+        return None
+    return _etag(request.path, list(fields), row["modified"])
+
+
+def _post_last_modified(request, post_id):
+    row = _post_row(request, post_id)[1]
+    return row and row["modified"]
+
+
+@condition(etag_func=_post_etag, last_modified_func=_post_last_modified)
+def post_view(request, post_id):
+    fields, row = _post_row(request, post_id)
+    if fields is None:
+        return _error("Неверный параметр ?fields=", 400)
+    if row is None:
+        return _error("Не найдено", 404)
+    return JsonResponse(serialize([row], fields)[0])
+
+
+def _comments_state(request, post_id):
+    # новый или удалённый комментарий сдвигает время изменения поста и
+    # его счётчик комментариев (время в SQLite - с точностью до секунды)
+    if not hasattr(request, "_comments_state"):
+        request._comments_state = Post.objects.filter(pk=post_id) \
+            .values_list("modified", "comment_count").first()
+    return request._comments_state
+
+
+def _comments_etag(request, post_id):
+    state = _comments_state(request, post_id)
+    if state is None:
+        return None
+    return _etag(request.path, request.GET.get("fields", ""),
+                 request.GET.get("after", ""), state)
+
+
+def _comments_last_modified(request, post_id):
+    state = _comments_state(request, post_id)
+    return state and state[0]
+
+
+@condition(etag_func=_comments_etag,
+           last_modified_func=_comments_last_modified)
+def post_comments(request, post_id):
+    """Комментарии поста страницами по курсору ?after=."""
+    fields = requested_fields(request, COMMENT_FIELDS)
+    token = request.GET.get("after", "")
+    after = decode_cursor(token) if token else None
+    if fields is None or (token and after is None):
+        return _error("Неверный параметр ?fields= или ?after=", 400)
+    if _comments_state(request, post_id) is None:
+        return _error("Не найдено", 404)
+    rows = list(comments_after(post_id, after)
+                .values("pk", "created", *fields.values())
+                [:COMMENTS_PER_PAGE + 1])
+    page = rows[:COMMENTS_PER_PAGE]
+    next_cursor = None
+    if len(rows) > COMMENTS_PER_PAGE:
+        next_cursor = encode_cursor(page[-1]["created"], page[-1]["pk"])
+    return JsonResponse({"comments": serialize(page, fields),
+                         "next": next_cursor})
+
+
+def _batch(request, param):
+    # без повторов, в порядке запроса
+    values = [value.strip() for value in request.GET.get(param, "").split(",")]
+    return list(dict.fromkeys(value for value in values if value))
+
+
+def _batch_error(param):
+    return _error(f"Нужно от 1 до {BATCH_LIMIT} значений ?{param}= "
+                  f"и известные ?fields=", 400)
+
+
+def posts_batch(request):
+    """Посты по ?ids=1,2,3 в порядке запроса; ненайденные - в missing."""
+    fields = requested_fields(request, POST_FIELDS)
+    ids = _batch(request, "ids")
+    if fields is None or not 0 < len(ids) <= BATCH_LIMIT \
+            or not all(ID_RE.match(pk) for pk in ids):
+        return _batch_error("ids")
+    ids = list(dict.fromkeys(int(pk) for pk in ids))
+    rows = object_cache.get_posts(ids, POST_FIELDS.values())
+    return JsonResponse({
+        "posts": serialize([rows[pk] for pk in ids if pk in rows], fields),
+        "missing": [pk for pk in ids if pk not in rows],
+    })
+
+
+def users_batch(request):
+    """Пользователи со счётчиками по ?usernames=a,b в порядке запроса."""
+    fields = requested_fields(request, USER_FIELDS)
+    usernames = _batch(request, "usernames")
+    if fields is None or not 0 < len(usernames) <= BATCH_LIMIT:
+        return _batch_error("usernames")
+    # такие имена не найдутся, и в ключи кеша они тоже не попадают
+    valid = [name for name in usernames if USERNAME_RE.match(name)]
+    rows = object_cache.get_users(valid, USER_FIELDS.values())
+    return JsonResponse({
+        "users": serialize([rows[name] for name in usernames if name in rows],
+                           fields),
+        "missing": [name for name in usernames if name not in rows],
+    })
+
+
+def posts_since(request, post_list):
+    """Посты ленты новее курсора ?since= от старых к новым."""
+    fields = requested_fields(request, POST_FIELDS)
+    since = decode_cursor(request.GET.get("since", ""))
+    if since is None or fields is None:
+        return _error("Нужен курсор ?since= и известные ?fields=", 400)
+    pub_date, pk = since
+    newer = post_list.filter(Q(pub_date__gt=pub_date) |
+                             Q(pub_date=pub_date, pk__gt=pk)) \
+        .order_by("pub_date", "pk")
+    rows = list(post_values(newer, fields)[:SINCE_LIMIT + 1])
+    if not rows:
+        return _no_content()
+    page = rows[:SINCE_LIMIT]
+    last = page[-1]
+    return JsonResponse({"posts": serialize(page, fields),
+                         "since": encode_cursor(last["pub_date"], last["pk"]),
+                         "more": len(rows) > SINCE_LIMIT})
+
+
+def index_since(request):
+    return posts_since(request, _index_feed(request))
+
+
+def group_since(request, slug):
+    return posts_since(request, _group_feed(request, slug))
+
+
+def profile_since(request, username):
+    return posts_since(request, _profile_feed(request, username))
+
+
+def follow_since(request):
+    if not request.user.is_authenticated:
+        return _error("Нужна авторизация", 401)
+    return posts_since(request, _follow_feed(request))
+
+
+def comments_since(request, post_id):
+    """Комментарии поста с id больше ?since_id= по порядку.
+
+    Несуществующий пост не проверяется отдельным запросом: для него, как
+    и для поста без новых комментариев, ответ 204.
+    """
+    fields = requested_fields(request, COMMENT_FIELDS)
+    since_id = request.GET.get("since_id", "")
+    if not ID_RE.match(since_id) or fields is None:
+        return _error("Нужен ?since_id= и известные ?fields=", 400)
+    rows = list(Comment.objects.filter(post_id=post_id, pk__gt=since_id)
+                .order_by("pk").values("pk", *fields.values())
+                [:SINCE_LIMIT + 1])
+    if not rows:
+        return _no_content()
+    page = rows[:SINCE_LIMIT]
+    return JsonResponse({"comments": serialize(page, fields),
+                         "since_id": page[-1]["pk"],
+                         "more": len(rows) > SINCE_LIMIT})
@@ -0,0 +1,65 @@
+"""Массовые операции админки.
+
+Удаление тысяч строк одним запросом держит транзакцию и блокировки,
+пока не удалится всё, а страница админки ждёт ответа. Здесь операция
+ставится в очередь в базе (BulkJob) и выполняется командой
+process_bulk_jobs, а строки удаляются пачками по первичному ключу:
+каждая пачка - своя короткая транзакция. Сигналы постов по-прежнему
+поддерживают счётчики, файлы и поисковый индекс, а ленты сбрасываются
+раз на пачку, после её фиксации.
+"""
+import json
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import BulkJob
+from .signals import deferred_invalidation
+
+BATCH_SIZE = getattr(settings, "BULK_BATCH_SIZE", 500)
+# 0 - выполнять прямо в запросе, без очереди (для отладки)
+WORKERS = getattr(settings, "BULK_WORKERS", 1)
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_batches(model, lookups, batch_size=BATCH_SIZE):
+    """Удаляет пачками строки model ("app_label.Model"), отобранные
+    filter(**lookups), и возвращает их число."""
+    queryset = apps.get_model(model).objects.filter(**lookups)
+    total = 0
+    while True:
+        ids = list(queryset.order_by("pk")
+                   .values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return total
+        with transaction.atomic(), deferred_invalidation():
+            queryset.model.objects.filter(pk__in=ids).delete()
+        total += len(ids)
+
+
+def schedule(task, *args):
+    """Ставит task(*args) в очередь process_bulk_jobs.
+
+    task - функция уровня модуля, args - значения, которые переживут
+    JSON. При WORKERS = 0 выполняет задачу сразу и возвращает результат.
+    """
+    if not WORKERS:
+        return task(*args)
+    BulkJob.objects.create(task=f"{task.__module__}.{task.__qualname__}",
+                           args=json.dumps(args))
+    return None
+
+
+def run(job):
+    """Выполняет задачу очереди; ошибка записывается в лог и
+    пробрасывается."""
+    task = import_string(job.task)
+    try:
+        return task(*json.loads(job.args))
+    except Exception:
+        logger.exception("Фоновая операция %s не выполнена", job.task)
+        raise
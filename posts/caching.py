@@ -0,0 +1,167 @@
+import hashlib
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+FEED_CACHE_TIMEOUT = getattr(settings, "FEED_CACHE_TIMEOUT", 300)
+# сколько секунд после истечения TTL можно отдавать устаревшее значение,
+# пока один из воркеров его пересчитывает
+STALE_GRACE = getattr(settings, "CACHE_STALE_GRACE", 60)
+LOCK_TIMEOUT = 10
+# сколько ждать чужого пересчёта, если отдать нечего
+WAIT_TIMEOUT = 1.0
+WAIT_STEP = 0.05
+# коэффициент вероятностного раннего обновления (XFetch)
+EARLY_REFRESH_BETA = 1.0
+METRICS = ("recomputed", "early", "stale", "coalesced", "waited")
+
+
+def index_namespace():
+    return "feed:index"
+
+
+def group_namespace(group_id):
+    return f"feed:group:{group_id}"
+
+
+def profile_namespace(author_id):
+    return f"feed:profile:{author_id}"
+
+
+def follow_namespace(user_id):
+    return f"feed:follow:{user_id}"
+
+
+def comments_namespace(namespace):
+    """Комментарии постов ленты namespace: от них зависит только
+    состояние страницы (posts.conditional), но не её фрагменты."""
+    return f"comments:{namespace}"
+
+
+def _version_key(namespace):
+    return f"ns:{namespace}"
+
+
+def _initial_version():
+    # версия после вытеснения ключа не должна совпасть с прежней
+    return int(time.time() * 1000)
+
+
+def get_versions(namespaces):
+    """Текущие версии пространств имён; отсутствующие создаются."""
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, namespace in keys.items():
+        if namespace not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[namespace] = cache.get(key, _initial_version())
+    return versions
+
+
+def bump(*namespaces):
+    """Делает недействительными все ключи пространств имён."""
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def cursor_token(request):
+    # порядок тот же, что у pagination.paginate: before важнее after,
+    # а курсор - важнее ?page=
+    for param in ("before", "after", "page"):
+        if param in request.GET:
+            return f"{param}={request.GET[param]}"
+    return "page=1"
+
+
+def feed_key(request, *namespaces):
+    """Ключ страницы ленты: пространства имён, их версии и курсор.
+
+    Первое пространство имён определяет саму ленту, остальные - ленты,
+    из которых она собирается (например, авторы, читаемые напрямую).
+    """
+    versions = get_versions(namespaces)
+    parts = [f"{namespace}@{versions[namespace]}" for namespace in namespaces]
+    parts.append(cursor_token(request))
+    return "|".join(parts)
+
+
+def _count(metric):
+    key = f"stampede:{metric}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def stampede_stats():
+    """Счётчики пересчётов и того, сколько из них удалось объединить."""
+    found = cache.get_many([f"stampede:{metric}" for metric in METRICS])
+    return {metric: found.get(f"stampede:{metric}", 0) for metric in METRICS}
+
+
+def reset_stampede_stats():
+    cache.delete_many([f"stampede:{metric}" for metric in METRICS])
+
+
+def _recompute(key, lock_key, compute, timeout):
+    try:
+        started = time.time()
+        value = compute()
+        finished = time.time()
+        cache.set(key, (value, finished + timeout, finished - started),
+                  timeout + STALE_GRACE)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+    _count("recomputed")
+    return value
+
+
+def get_or_compute(key, compute, timeout):
+    """cache.get_or_set с защитой от одновременного пересчёта.
+
+    Значение пересчитывает только тот, кто взял блокировку. Остальные
+    в это время получают прежнее значение (stale-while-revalidate) или,
+    если его нет, ждут результата. Незадолго до истечения TTL значение
+    с растущей вероятностью пересчитывается заранее, так что горячие
+    ключи обычно не истекают совсем.
+    """
+    lock_key = f"lock:{key}"
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires, delta = entry
+        now = time.time()
+        early = delta * EARLY_REFRESH_BETA * -math.log(1 - random.random())
+        if now + early < expires:
+            return value
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            _count("coalesced")
+            return value
+        _count("early" if now < expires else "stale")
+        return _recompute(key, lock_key, compute, timeout)
+
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        return _recompute(key, lock_key, compute, timeout)
+    deadline = time.time() + WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            _count("waited")
+            return entry[0]
+    # пересчитывающий воркер завис или упал - не ждём дольше
+    return _recompute(key, None, compute, timeout)
+
+
+def fragment_key(name, key):
+    digest = hashlib.md5(str(key).encode()).hexdigest()
+    return f"fragment:{name}:{digest}"
@@ -0,0 +1,78 @@
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .thumbnails import is_pending, prefetch
+from .variants import card_variants
+
+CARD_CACHE_TIMEOUT = getattr(settings, "CARD_CACHE_TIMEOUT", 24 * 60 * 60)
+SLOT_RE = re.compile(r"<!--(comments|edit):(\d+)-->")
+
+
+def card_key(post):
+    return f"card:{post.pk}:{post.version}"
+
+
+def render_cards(posts):
+    """HTML карточек постов: попадания из кеша одним get_many,
+    промахи рендерятся и сохраняются одним set_many."""
+    keys = {card_key(post): post for post in posts}
+    cards = cache.get_many(keys)
+    stale = [post for key, post in keys.items() if key not in cards]
+    variants = {post.pk: card_variants(post.image) for post in stale}
+    # миниатюры карточек без вариантов - одним чтением key-value store
+    thumbnails = prefetch([post.image for post in stale
+                           if variants[post.pk] == (None, False)])
+    missing = {}
+    for post in stale:
+        missing[card_key(post)] = render_to_string(
+            "includes/post_card.html",
+            {"post": post, "card_variants": variants[post.pk],
+             "card_thumbnail": thumbnails.get(post.image.name)})
+    if missing:
+        # карточки с заглушкой вместо миниатюры не кешируются
+        cache.set_many({key: card for key, card in missing.items()
+                        if not is_pending(card)}, CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+def _comments_slot(post):
+    if post["comment_count"]:
+        return f"{post['comment_count']} комментариев"
+    return "Добавить комментарий"
+
+
+def _edit_slot(post, user):
+    if post["author_id"] != user.pk:
+        return ""
+    url = reverse("post_edit", args=(post["author__username"], post["pk"]))
+    return format_html('<a class="btn btn-sm text-muted" href="{}" '
+                       'role="button">Редактировать</a>', url)
+
+
+def fill_slots(html, user):
+    """Подставляет в закешированные карточки то, что меняется чаще
+    карточки (число комментариев) или зависит от зрителя (ссылку
+    редактирования). Данные для всей страницы - одним запросом."""
+    ids = {int(pk) for _, pk in SLOT_RE.findall(html)}
+    if not ids:
+        return html
+    posts = {post["pk"]: post for post in Post.objects.filter(pk__in=ids)
+             .values("pk", "comment_count", "author_id", "author__username")}
+
+    def fill(match):
+        post = posts.get(int(match.group(2)))
+        if post is None:
+            return ""
+        if match.group(1) == "comments":
+            return _comments_slot(post)
+        return _edit_slot(post, user)
+
+    return SLOT_RE.sub(fill, html)
@@ -0,0 +1,83 @@
+"""Комментарии поста страницами по курсору.
+
+Страница поста показывает первые COMMENTS_PER_PAGE комментариев, а
+остальные подгружаются кнопкой «Показать ещё» страницами после курсора
+(created, id) - это диапазон индекса comment_post_created_id_idx, и его
+стоимость не зависит от того, сколько комментариев уже показано.
+Страницы кешируются по времени последнего изменения поста, которое
+сдвигает каждый новый или удалённый комментарий.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.template.loader import render_to_string
+
+from . import caching
+from .models import Comment
+from .pagination import encode_cursor
+
+COMMENTS_PER_PAGE = getattr(settings, "COMMENTS_PER_PAGE", 20)
+COMMENTS_CACHE_TIMEOUT = getattr(settings, "COMMENTS_CACHE_TIMEOUT", 60 * 60)
+
+
+def comments_after(post_id, after=None):
+    """Комментарии поста по порядку, начиная после курсора."""
+    queryset = Comment.objects.filter(post_id=post_id) \
+        .select_related("author").order_by("created", "pk")
+    if after is not None:
+        created, pk = after
+        queryset = queryset.filter(Q(created__gt=created) |
+                                   Q(created=created, pk__gt=pk))
+    return queryset
+
+
+def next_cursor(comments):
+    last = comments[len(comments) - 1]
+    return encode_cursor(last.created, last.pk)
+
+
+def first_page(post):
+    """Первая страница для post_view: (queryset, курсор следующей).
+
+    Есть ли продолжение, видно по счётчику комментариев поста, так что
+    лишняя строка не выбирается.
+    """
+    comments = comments_after(post.pk)[:COMMENTS_PER_PAGE]
+    if post.comment_count <= COMMENTS_PER_PAGE or not comments:
+        return comments, None
+    return comments, next_cursor(comments)
+
+
+def _page(post_id, after):
+    rows = list(comments_after(post_id, after)[:COMMENTS_PER_PAGE + 1])
+    comments = rows[:COMMENTS_PER_PAGE]
+    cursor = next_cursor(comments) if len(rows) > COMMENTS_PER_PAGE else None
+    return comments, cursor
+
+
+def render_page(post_id, username, after):
+    """HTML страницы комментариев со ссылкой на следующую."""
+    comments, cursor = _page(post_id, after)
+    return render_to_string("includes/comment_list.html",
+                            {"comments": comments, "next_cursor": cursor,
+                             "post_id": post_id, "username": username})
+
+
+def page_data(post_id, after):
+    """Страница комментариев для JSON."""
+    comments, cursor = _page(post_id, after)
+    return {
+        "comments": [{"id": comment.pk,
+                      "author": comment.author.username,
+                      "text": comment.text,
+                      "created": comment.created.isoformat()}
+                     for comment in comments],
+        "next": cursor,
+    }
+
+
+def cached_page(kind, post_id, modified, token, compute):
+    """Страница комментариев из кеша; ключ - пост, время его изменения,
+    курсор и формат."""
+    key = caching.fragment_key(
+        "comments", (kind, post_id, modified.isoformat(), token))
+    return caching.get_or_compute(key, compute, COMMENTS_CACHE_TIMEOUT)
@@ -0,0 +1,155 @@
+import hashlib
+
+from . import caching
+from .caching import cursor_token
+from .models import Group, Post, User
+from .pagination import paginate
+
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _viewer(request):
+    return request.user.pk if request.user.is_authenticated else None
+
+
+def feed_state(request, post_list, namespaces=()):
+    """Состояние окна ленты и Last-Modified без рендеринга страницы.
+
+    Окно - это ключи и время правки постов текущей страницы; правка и
+    комментарии двигают Post.modified, новые и удалённые посты меняют
+    состав окна. От зрителя состояние не зависит, поэтому по нему же
+    кешируется оболочка страницы (posts.page_cache). Результат
+    запоминается на запросе, т.к. condition() спрашивает ETag и
+    Last-Modified по отдельности. Числа постов в состоянии нет: пейджеру
+    нужно лишь, есть ли страницы до и после.
+
+    post_list - те же посты, что выводит представление: paginate()
+    запоминает страницу на запросе, и представление её переиспользует.
+    Само состояние кешируется по версиям namespaces и их комментариев
+    через get_or_compute, так что после сброса ленты страницу выбирает
+    из базы один воркер, а не все запросы разом.
+    """
+    if not hasattr(request, "_feed_state"):
+        def compute():
+            _, page = paginate(request, post_list)
+            posts = list(page.object_list)
+            last_modified = max((post.modified for post in posts),
+                                default=None)
+            state = _etag(request.path, cursor_token(request),
+                          page.has_previous(), page.has_next(),
+                          [post.pk for post in posts], last_modified)
+            return state, last_modified
+
+        if namespaces:
+            comments = [caching.comments_namespace(namespace)
+                        for namespace in namespaces]
+            key = caching.fragment_key(
+                "feed_state",
+                (request.path,
+                 caching.feed_key(request, *namespaces, *comments)))
+            request._feed_state = caching.get_or_compute(
+                key, compute, caching.FEED_CACHE_TIMEOUT)
+        else:
+            request._feed_state = compute()
+    return request._feed_state
+
+
+def _index_feed_state(request):
+    return feed_state(request, Post.objects.feed(),
+                      (caching.index_namespace(),))
+
+
+def index_state(request):
+    return _index_feed_state(request)[0]
+
+
+def index_etag(request):
+    return _etag(_viewer(request), index_state(request))
+
+
+def index_last_modified(request):
+    return _index_feed_state(request)[1]
+
+
+def _group_feed_state(request, slug):
+    if not hasattr(request, "_group_state"):
+        # в шапке ленты выводятся название и описание группы
+        group = Group.objects.filter(slug=slug) \
+            .values_list("pk", "title", "description").first()
+        if group is None:
+            state, last_modified = feed_state(request, Post.objects.none())
+        else:
+            state, last_modified = feed_state(
+                request, Post.objects.feed().filter(group_id=group[0]),
+                (caching.group_namespace(group[0]),))
+        request._group_state = _etag(state, group), last_modified
+    return request._group_state
+
+
+def group_state(request, slug):
+    return _group_feed_state(request, slug)[0]
+
+
+def group_etag(request, slug):
+    return _etag(_viewer(request), group_state(request, slug))
+
+
+def group_last_modified(request, slug):
+    return _group_feed_state(request, slug)[1]
+
+
+def _author_state(request, username):
+    if not hasattr(request, "_author_state"):
+        # в карточке автора выводятся его счётчики
+        author = User.objects.filter(username=username).values_list(
+            "pk", "stats__followers", "stats__following",
+            "stats__posts").first()
+        author_id, *stats = author or (None,)
+        namespaces = (caching.profile_namespace(author_id),) \
+            if author_id else ()
+        posts = Post.objects.feed().filter(author_id=author_id)
+        state, last_modified = feed_state(request, posts, namespaces)
+        request._author_state = _etag(state, stats), last_modified
+    return request._author_state
+
+
+def profile_state(request, username):
+    return _author_state(request, username)[0]
+
+
+def profile_etag(request, username):
+    return _etag(_viewer(request), profile_state(request, username))
+
+
+def profile_last_modified(request, username):
+    return _author_state(request, username)[1]
+
+
+def _post_state(request, username, post_id):
+    if not hasattr(request, "_post_state"):
+        post = Post.objects.filter(pk=post_id, author__username=username) \
+            .values_list("modified", "author__stats__followers",
+                         "author__stats__following",
+                         "author__stats__posts").first()
+        if post is None:
+            request._post_state = None, None
+        else:
+            request._post_state = _etag(request.path, post), post[0]
+    return request._post_state
+
+
+def post_state(request, username, post_id):
+    return _post_state(request, username, post_id)[0]
+
+
+def post_etag(request, username, post_id):
+    state = post_state(request, username, post_id)
+    if state is None:
+        return None
+    return _etag(_viewer(request), state)
+
+
+def post_last_modified(request, username, post_id):
+    return _post_state(request, username, post_id)[1]
@@ -1,4 +1,6 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm, Textarea
+from .ingest import normalize
 from .models import Post, Comment
 
 
@@ -16,6 +18,13 @@ class PostForm(ModelForm):
             'text': 'Впишите текст новости'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # при правке без новой загрузки здесь уже сохранённый файл
+        if isinstance(image, UploadedFile):
+            image = normalize(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
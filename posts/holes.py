@@ -0,0 +1,71 @@
+"""Личные фрагменты страниц ("дыры" в закешированной оболочке).
+
+Всё, что зависит от зрителя, в шаблонах выводится тегом {% hole %}.
+При обычном рендеринге тег сразу рисует фрагмент, а при рендеринге
+оболочки (page_shell в контексте) оставляет метку <!--hole:...-->,
+которую personalize() заполняет отдельно для каждого запроса.
+"""
+import re
+from urllib.parse import parse_qsl, quote
+
+from django.template.loader import render_to_string
+
+from .cards import fill_slots
+from .forms import CommentForm
+from .models import Follow, User
+
+HOLE_RE = re.compile(r"<!--hole:(\w+)(?:\?([^>]*))?-->")
+
+
+def nav(request):
+    return render_to_string("nav.html", request=request)
+
+
+def menu(request, active):
+    return render_to_string("menu.html", {active: True}, request=request)
+
+
+def follow(request, author_id, username):
+    author = User(pk=int(author_id), username=username)
+    is_following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author_id=author.pk).exists()
+    return render_to_string("includes/follow_card.html",
+                            {"author": author, "is_following": is_following},
+                            request=request)
+
+
+def comment_form(request, post_id, username):
+    if not request.user.is_authenticated:
+        return ""
+    return render_to_string("includes/comment_form.html",
+                            {"form": CommentForm(), "post_id": post_id,
+                             "username": username},
+                            request=request)
+
+
+HOLES = {
+    "nav": nav,
+    "menu": menu,
+    "follow": follow,
+    "comment_form": comment_form,
+}
+
+
+def marker(name, **params):
+    # "--" внутри HTML-комментария недопустимо, поэтому кодируем и дефис
+    query = "&".join(f"{key}={quote(str(value), safe='').replace('-', '%2D')}"
+                     for key, value in params.items())
+    return f"<!--hole:{name}?{query}-->" if query else f"<!--hole:{name}-->"
+
+
+def render_hole(request, name, **params):
+    return HOLES[name](request, **params)
+
+
+def personalize(html, request):
+    """Заполняет дыры оболочки и слоты карточек для текущего зрителя."""
+    html = HOLE_RE.sub(
+        lambda match: render_hole(request, match.group(1),
+                                  **dict(parse_qsl(match.group(2) or ""))),
+        html)
+    return fill_slots(html, request.user)
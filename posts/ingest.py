@@ -0,0 +1,103 @@
+"""Приём загруженных картинок с ограниченным расходом памяти.
+
+Загрузка целиком пишется во временный файл (FILE_UPLOAD_HANDLERS), а
+не держится в памяти воркера. Размеры читаются из заголовка без
+декодирования, и слишком большие картинки отклоняются. Только JPEG
+можно уменьшить ещё при декодировании (draft), так что полноразмерный
+растр не строится. Остальные форматы (PNG, GIF, WebP...) декодируются
+целиком, поэтому для них предел IMAGE_MAX_OTHER_PIXELS намного ниже:
+он и ограничивает память, нужную на одну загрузку.
+Сохраняется нормализованный оригинал: повёрнутый по EXIF, без EXIF и
+не больше IMAGE_MAX_SIDE по длинной стороне.
+"""
+import io
+import math
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from PIL import Image, ImageOps
+
+# больше - отклоняем: даже заголовок такой картинки подозрителен
+MAX_PIXELS = getattr(settings, "IMAGE_MAX_PIXELS", 100_000_000)
+# не-JPEG декодируется целиком (Pillow хранит RGB по 4 байта на
+# пиксель), и вместе с ресэмплингом пик памяти - около 8 байт на пиксель
+MAX_OTHER_PIXELS = getattr(settings, "IMAGE_MAX_OTHER_PIXELS", 12_000_000)
+MAX_SIDE = getattr(settings, "IMAGE_MAX_SIDE", 2560)
+JPEG_QUALITY = 88
+ORIENTATION = 0x0112
+
+
+def _target_size(width, height):
+    scale = min(1, MAX_SIDE / max(width, height))
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA") or \
+        (image.mode == "P" and "transparency" in image.info)
+
+
+def normalize(upload):
+    """Возвращает нормализованную копию загрузки.
+
+    Бросает ValidationError, если картинка слишком велика или Pillow не
+    смог её обработать.
+    """
+    try:
+        return _normalize(upload)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        raise ValidationError(f"Не удалось обработать изображение: {error}",
+                              code="invalid_image")
+
+
+def _normalize(upload):
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    limit = MAX_PIXELS if image.format == "JPEG" else MAX_OTHER_PIXELS
+    if width * height > limit:
+        raise ValidationError(
+            f"Изображение слишком большое: {width}x{height}, "
+            f"допустимо не больше {limit / 1_000_000:g} Мп.",
+            code="too_large")
+
+    target = _target_size(width, height)
+    if image.format == "JPEG":
+        # декодер сразу уменьшает картинку в 2, 4 или 8 раз
+        image.draft("RGB", target)
+    if _has_alpha(image):
+        mode, fmt, extension, options = "RGBA", "PNG", "png", \
+            {"optimize": True}
+    else:
+        mode, fmt, extension, options = "RGB", "JPEG", "jpg", \
+            {"quality": JPEG_QUALITY, "optimize": True}
+    # reduce и LANCZOS не работают с палитрой и 1-битными картинками
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert(mode)
+    factor = min(image.width // target[0], image.height // target[1])
+    if factor >= 2:
+        # остальные форматы уже декодированы целиком (их размер ограничен
+        # MAX_OTHER_PIXELS); reduce дешевле ресэмплинга с полного размера
+        image = image.reduce(factor)
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    # поворот по EXIF применяем к пикселям, сам EXIF не сохраняем;
+    # лишних копий растра не делаем
+    if image.getexif().get(ORIENTATION, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode != mode:
+        image = image.convert(mode)
+    image.info.pop("exif", None)
+    if "icc_profile" in image.info:
+        options["icc_profile"] = image.info["icc_profile"]
+
+    # результат не больше MAX_SIDE и сжат, его можно держать в памяти
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    image.close()
+    stem = os.path.splitext(os.path.basename(upload.name))[0] or "image"
+    return InMemoryUploadedFile(buffer, "image", f"{stem}.{extension}",
+                                Image.MIME[fmt], buffer.tell(), None)
@@ -0,0 +1,97 @@
+"""Key-value store для sorl-thumbnail с пакетным чтением.
+
+sorl-thumbnail читает метаданные каждой миниатюры отдельным запросом
+к хранилищу. Здесь к обоим хранилищам добавлен get_many(), которым
+posts.thumbnails.prefetch получает метаданные всей страницы сразу.
+
+CacheKVStore держит метаданные только в кеше (THUMBNAIL_CACHE) без
+таблицы thumbnail_kvstore: это имеет смысл, только когда кеш общий для
+всех процессов, включая process_images. Потерянная запись восстанавливается при следующем обращении
+по готовому файлу миниатюры.
+"""
+from django.core.cache import InvalidCacheBackendError, cache, caches
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import KVStoreBase, add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+def _kv_cache():
+    try:
+        return caches[settings.THUMBNAIL_CACHE]
+    except InvalidCacheBackendError:
+        return cache
+
+
+def _images(raw_keys, values):
+    return {raw_keys[key]: deserialize_image_file(value)
+            for key, value in values.items() if value}
+
+
+class CacheKVStore(KVStoreBase):
+
+    @property
+    def cache(self):
+        return _kv_cache()
+
+    def set(self, image_file, source=None):
+        # в отличие от базового класса не требуем, чтобы оригинал был
+        # в хранилище: кеш мог уже вытеснить его запись
+        image_file.set_size()
+        self._set(image_file.key, image_file)
+        if source is not None:
+            thumbnails = set(self._get(source.key, identity="thumbnails") or [])
+            thumbnails.add(image_file.key)
+            self._set(source.key, list(thumbnails), identity="thumbnails")
+
+    def get_many(self, image_files):
+        """{ключ ImageFile: ImageFile} для найденных в хранилище файлов."""
+        raw_keys = {add_prefix(image_file.key): image_file.key
+                    for image_file in image_files}
+        return _images(raw_keys, self.cache.get_many(raw_keys))
+
+    def _get_raw(self, key):
+        return self.cache.get(key)
+
+    def _set_raw(self, key, value):
+        self.cache.set(key, value, settings.THUMBNAIL_CACHE_TIMEOUT)
+
+    def _delete_raw(self, *keys):
+        self.cache.delete_many(keys)
+
+    def _find_keys_raw(self, prefix):
+        # перебирать ключи кеша нельзя, поэтому cleanup и clear
+        # для этого хранилища ничего не делают
+        return []
+
+
+class CachedDBKVStore(cached_db_kvstore.KVStore):
+    """Стандартное хранилище sorl-thumbnail (кеш поверх таблицы)
+    с get_many: промахи кеша дочитываются одним запросом к таблице.
+
+    В отличие от стандартного, отсутствие записи не кешируется: запись
+    делает другой процесс (команда process_images), и локальный кеш
+    воркера иначе так и не увидел бы готовую миниатюру.
+    """
+
+    def get_many(self, image_files):
+        raw_keys = {add_prefix(image_file.key): image_file.key
+                    for image_file in image_files}
+        values = self.cache.get_many(raw_keys)
+        missing = [key for key in raw_keys if key not in values]
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(key__in=missing)
+                          .values_list("key", "value"))
+            self.cache.set_many(stored, settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(stored)
+        return _images(raw_keys, values)
+
+    def _get_raw(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            value = KVStoreModel.objects.filter(key=key) \
+                .values_list("value", flat=True).first()
+            if value is not None:
+                self.cache.set(key, value, settings.THUMBNAIL_CACHE_TIMEOUT)
+        return value
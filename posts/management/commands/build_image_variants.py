@@ -0,0 +1,45 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.core.management.base import BaseCommand
+
+from posts import variants
+from posts.models import Post
+
+
+def _build(name, force):
+    # выполняется в рабочем процессе; ошибка одной картинки не должна
+    # останавливать остальные
+    try:
+        return name, variants.generate(name, force=force), None
+    except OSError as error:
+        return name, 0, error
+
+
+class Command(BaseCommand):
+    help = "Строит адаптивные варианты картинок существующих постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help="число процессов, по умолчанию - по числу ядер")
+        parser.add_argument("--chunk-size", type=int, default=16)
+        parser.add_argument("--force", action="store_true",
+                            help="перестроить и уже готовые варианты")
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image="").values_list("image", flat=True) \
+            .distinct().iterator()
+        built = skipped = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            results = executor.map(_build, names, repeat(options["force"]),
+                                    chunksize=options["chunk_size"])
+            for name, written, error in results:
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                elif written:
+                    built += 1
+                else:
+                    skipped += 1
+        self.stdout.write(f"Построено: {built}, уже были: {skipped}, "
+                          f"ошибок: {failed}")
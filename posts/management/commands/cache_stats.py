@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import caching
+
+
+class Command(BaseCommand):
+    help = "Показывает, сколько пересчётов кеша выполнено и сколько объединено"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true",
+                            help="обнулить счётчики после вывода")
+
+    def handle(self, *args, **options):
+        for metric, value in caching.stampede_stats().items():
+            self.stdout.write(f"{metric}: {value}")
+        if options["reset"]:
+            caching.reset_stampede_stats()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import media
+
+
+class Command(BaseCommand):
+    help = ("Переносит картинки постов в хранилище, адресуемое содержимым, "
+            "и пересчитывает ссылки на файлы")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int,
+                            default=media.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        moved, updated, missing = media.migrate(
+            batch_size=options["batch_size"])
+        self.stdout.write(f"Перенесено файлов: {moved}, обновлено постов: "
+                          f"{updated}, нет на диске: {missing}")
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from posts.models import BulkJob
+
+
+class Command(BaseCommand):
+    help = "Разбирает очередь массовых операций админки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="выйти, когда очередь опустеет")
+        parser.add_argument("--sleep", type=float, default=1.0,
+                            help="пауза между проверками пустой очереди, с")
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        while True:
+            job = BulkJob.objects.order_by("pk").first()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+            # задача удаляется только после выполнения: если команду
+            # остановят посреди удаления, оно продолжится при запуске
+            try:
+                bulk.run(job)
+            except Exception as error:
+                self.stderr.write(f"{job.task}: {error}")
+                failed += 1
+            else:
+                done += 1
+            job.delete()
+        self.stdout.write(f"Выполнено: {done}, ошибок: {failed}")
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from posts import thumbnails
+from posts.models import ImageJob
+
+
+def _init_worker():
+    # при запуске через spawn процессу нужен свой django.setup()
+    import django
+    django.setup()
+
+
+def _run(job):
+    # выполняется в рабочем процессе; ошибка одной картинки не должна
+    # останавливать очередь
+    task, name = job
+    try:
+        import_string(task)(name)
+    except Exception as error:
+        return error
+    return None
+
+
+class Command(BaseCommand):
+    help = "Разбирает очередь картинок: миниатюры и адаптивные варианты"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int,
+                            default=thumbnails.WORKERS or None,
+                            help="число процессов, по умолчанию - THUMBNAIL_WORKERS")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--once", action="store_true",
+                            help="выйти, когда очередь опустеет")
+        parser.add_argument("--sleep", type=float, default=1.0,
+                            help="пауза между проверками пустой очереди, с")
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"],
+                                 initializer=_init_worker) as executor:
+            while True:
+                jobs = list(ImageJob.objects.order_by("pk")
+                            [:options["batch_size"]])
+                if not jobs:
+                    if options["once"]:
+                        break
+                    time.sleep(options["sleep"])
+                    continue
+                results = executor.map(
+                    _run, [(job.task, job.name) for job in jobs])
+                for job, error in zip(jobs, results):
+                    task = import_string(job.task)
+                    if error is not None:
+                        thumbnails.mark_failed(job.name, task, error)
+                        self.stderr.write(f"{job.name}: {error}")
+                        failed += 1
+                    else:
+                        thumbnails.complete(job.name, task)
+                        done += 1
+                ImageJob.objects.filter(pk__in=[job.pk for job in jobs]) \
+                    .delete()
+        self.stdout.write(f"Обработано: {done}, ошибок: {failed}")
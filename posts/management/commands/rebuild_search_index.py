@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Заново строит поисковый индекс постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int,
+                            default=search.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = search.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(f"Проиндексировано постов: {total}")
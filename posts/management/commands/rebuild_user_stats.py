@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики подписчиков, подписок, постов и комментариев"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int,
+                            default=stats.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = stats.rebuild(batch_size=options["batch_size"])
+        self.stdout.write(f"Счётчики пересчитаны для {total} пользователей")
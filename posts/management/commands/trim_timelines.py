@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = "Обрезает ленты подписок до TIMELINE_LENGTH записей (запускать по расписанию)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int,
+                            default=timeline.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = timeline.trim_all(batch_size=options["batch_size"])
+        self.stdout.write(f"Обрезано лент: {total}")
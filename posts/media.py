@@ -0,0 +1,154 @@
+"""Ссылки постов на файлы картинок.
+
+Файл в хранилище, адресуемом содержимым (posts.storage), может
+принадлежать нескольким постам. StoredFile.references считает эти
+ссылки: сигналы постов увеличивают его при загрузке и уменьшают при
+замене картинки или удалении поста, а файл со всеми производными
+удаляется, когда ссылок не осталось. Файлы со старыми плоскими именами
+не делятся между постами и не считаются, пока их не перенесёт migrate().
+"""
+import os
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Now
+from sorl.thumbnail import delete as delete_thumbnails
+
+from . import caching, object_cache, variants
+from .models import Post, StoredFile
+from .storage import is_content_name
+
+BATCH_SIZE = 500
+
+storage = Post._meta.get_field("image").storage
+
+
+def acquire(name):
+    if not is_content_name(name):
+        return
+    with transaction.atomic():
+        # блокировка строки ждёт release() того же файла
+        if StoredFile.objects.select_for_update().filter(name=name) \
+                .update(references=F("references") + 1):
+            return
+        StoredFile.objects.get_or_create(name=name)
+        StoredFile.objects.filter(name=name) \
+            .update(references=F("references") + 1)
+
+
+def _variant_names(name):
+    return [variants.variant_name(name, width, extension)
+            for width in variants.WIDTHS
+            for extension, _, _ in variants.FORMATS]
+
+
+def delete_files(name):
+    """Удаляет файл со всеми производными, не глядя на ссылки."""
+    for variant in _variant_names(name):
+        default_storage.delete(variant)
+    # удаляет миниатюры sorl-thumbnail, их записи и сам оригинал
+    delete_thumbnails(name)
+
+
+def _delete_unused(name):
+    # пока транзакция шла, тот же файл могли загрузить снова
+    with transaction.atomic():
+        if StoredFile.objects.select_for_update().filter(name=name).exists():
+            return
+        delete_files(name)
+
+
+def release(name):
+    if not is_content_name(name):
+        return
+    # уменьшение и удаление строки - одна транзакция под блокировкой
+    # строки: acquire() между ними не вклинится
+    with transaction.atomic():
+        row = StoredFile.objects.select_for_update() \
+            .filter(name=name).first()
+        if row is None:
+            return
+        if row.references > 1:
+            StoredFile.objects.filter(name=name) \
+                .update(references=F("references") - 1)
+            return
+        row.delete()
+        # файл удаляется, только если строку удалила эта транзакция
+        transaction.on_commit(lambda: _delete_unused(name))
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Пересчитывает ссылки на все файлы по постам."""
+    totals = Post.objects.exclude(image="").exclude(image__isnull=True) \
+        .order_by().values_list("image").annotate(total=Count("pk"))
+    rows = [StoredFile(name=name, references=total)
+            for name, total in totals.iterator() if is_content_name(name)]
+    StoredFile.objects.exclude(name__in=[row.name for row in rows]).delete()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        StoredFile.objects.bulk_create(batch, ignore_conflicts=True)
+        StoredFile.objects.bulk_update(batch, ["references"])
+    return len(rows)
+
+
+def _adopt(name):
+    """Переносит файл и его варианты под адрес по содержимому."""
+    new_name = storage.adopt(name)
+    for old, new in zip(_variant_names(name), _variant_names(new_name)):
+        if not default_storage.exists(old):
+            continue
+        if default_storage.exists(new):
+            default_storage.delete(old)
+        else:
+            os.replace(default_storage.path(old), default_storage.path(new))
+    # миниатюры sorl-thumbnail построятся заново для нового имени
+    delete_thumbnails(name, delete_file=False)
+    return new_name
+
+
+def migrate(batch_size=BATCH_SIZE):
+    """Переносит картинки из плоской папки в хранилище по содержимому.
+
+    Посты обходятся пачками по первичному ключу. Файлы переименовываются
+    без копирования, одинаковые сливаются в один, а пути в постах
+    переписываются одним bulk_update на пачку. Возвращает число
+    перенесённых файлов, обновлённых постов и пропущенных файлов,
+    которых нет на диске.
+    """
+    moved = updated = missing = 0
+    last_pk = 0
+    while True:
+        batch = list(Post.objects.filter(pk__gt=last_pk)
+                     .exclude(image="").exclude(image__isnull=True)
+                     .order_by("pk").values_list("pk", "image")[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        renamed = {}
+        for name in {name for _, name in batch if not is_content_name(name)}:
+            if not storage.exists(name):
+                missing += 1
+                continue
+            renamed[name] = _adopt(name)
+        moved += len(renamed)
+
+        # тот же файл мог достаться и постам из следующих пачек
+        posts = list(Post.objects.filter(image__in=renamed)
+                     .only("pk", "image", "author_id", "group_id"))
+        for post in posts:
+            post.image = renamed[post.image.name]
+            # новые адреса картинок должны попасть в карточки и ETag
+            post.version = F("version") + 1
+            post.modified = Now()
+        with transaction.atomic():
+            Post.objects.bulk_update(posts, ["image", "version", "modified"])
+        object_cache.forget_posts([post.pk for post in posts])
+        updated += len(posts)
+        caching.bump(
+            caching.index_namespace(),
+            *{caching.profile_namespace(post.author_id) for post in posts},
+            *{caching.group_namespace(post.group_id)
+              for post in posts if post.group_id})
+    rebuild()
+    return moved, updated, missing
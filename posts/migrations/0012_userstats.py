@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserStats = apps.get_model('posts', 'UserStats')
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+
+    def totals(queryset, field):
+        return dict(queryset.order_by().values(field)
+                    .annotate(total=Count('pk')).values_list(field, 'total'))
+
+    followers = totals(Follow.objects, 'author')
+    following = totals(Follow.objects, 'user')
+    posts = totals(Post.objects, 'author')
+    comments = totals(Comment.objects, 'author')
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id,
+                   followers=followers.get(user_id, 0),
+                   following=following.get(user_id, 0),
+                   posts=posts.get(user_id, 0),
+                   comments=comments.get(user_id, 0))
+         for user_id in User.objects.values_list('pk', flat=True).iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers', models.IntegerField(default=0)),
+                ('following', models.IntegerField(default=0)),
+                ('posts', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
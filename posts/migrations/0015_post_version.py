@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
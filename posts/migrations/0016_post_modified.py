@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_modified(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(modified=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_modified, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:57
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def fill_references(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    StoredFile = apps.get_model('posts', 'StoredFile')
+    totals = Post.objects.exclude(image='').exclude(image__isnull=True) \
+        .order_by().values('image').annotate(total=Count('pk'))
+    StoredFile.objects.bulk_create(
+        StoredFile(name=row['image'], references=row['total'])
+        for row in totals.iterator()
+        if posts.storage.is_content_name(row['image']))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('references', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+        migrations.RunPython(fill_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations
+
+import posts.stemmer
+
+SQLITE_SCHEMA = (
+    "CREATE VIRTUAL TABLE posts_search USING fts5("
+    "text, group_title, author, tokenize='unicode61 remove_diacritics 2')"
+)
+POSTGRESQL_SCHEMA = (
+    "CREATE TABLE posts_search ("
+    "post_id integer PRIMARY KEY REFERENCES posts_post (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX posts_search_document ON posts_search USING GIN (document)",
+    "INSERT INTO posts_search (post_id, document) "
+    "SELECT p.id, "
+    "setweight(to_tsvector('russian', p.text), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(g.title, '')), 'B') || "
+    "setweight(to_tsvector('simple', u.username), 'B') "
+    "FROM posts_post p JOIN auth_user u ON u.id = p.author_id "
+    "LEFT JOIN posts_group g ON g.id = p.group_id",
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for statement in POSTGRESQL_SCHEMA:
+            schema_editor.execute(statement)
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_SCHEMA)
+        Post = apps.get_model('posts', 'Post')
+        rows = Post.objects.values_list('pk', 'text', 'group__title',
+                                        'author__username')
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO posts_search (rowid, text, group_title, author) '
+                'VALUES (%s, %s, %s, %s)',
+                [(pk, posts.stemmer.stem_text(text),
+                  posts.stemmer.stem_text(title), username.lower())
+                 for pk, text, title, username in rows.iterator()])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_stored_files'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_timeline_cursor_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('task', models.CharField(max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('name', 'task')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_image_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200)),
+                ('args', models.TextField(default='[]')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -10,6 +12,12 @@ class Group(models.Model):
     description = models.TextField()
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """Посты с автором и группой для карточек ленты."""
+        return self.select_related("author", "group")
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField("date published",
@@ -20,21 +28,51 @@ class Post(models.Model):
                               on_delete=models.SET_NULL,
                               related_name="posts")
     image = models.ImageField(upload_to='posts/',
+                              storage=ContentAddressedStorage(),
                               blank=True, null=True)
+    # поддерживается сигналами при добавлении и удалении комментариев
+    comment_count = models.IntegerField(default=0, editable=False)
+    # растёт при каждой правке, входит в ключ кеша карточки
+    version = models.IntegerField(default=0, editable=False)
+    # время последней правки поста или его комментариев, для Last-Modified
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=["pub_date", "id"],
+                         name="post_pub_date_id_idx"),
+            models.Index(fields=["author", "-pub_date"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date"],
+                         name="post_group_pub_date_idx"),
+        ]
 
 
 class Comment(models.Model):
     text = models.TextField()
+    # индекс по посту - составные индексы ниже
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
-                             related_name="comments")
+                             related_name="comments", db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="comments")
     created = models.DateTimeField("date published",
                                    auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # страницы комментариев поста по курсору (created, id)
+            models.Index(fields=["post", "created", "id"],
+                         name="comment_post_created_id_idx"),
+            # новые комментарии поста после известного клиенту id
+            models.Index(fields=["post", "id"], name="comment_post_id_idx"),
+            # date_hierarchy админки
+            models.Index(fields=["created", "id"],
+                         name="comment_created_id_idx"),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
@@ -44,3 +82,71 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ("user", "author")
+        indexes = [
+            models.Index(fields=["author", "user"],
+                         name="follow_author_user_idx"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты подписок: пост автора, разосланный подписчику."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            # post - второй ключ курсора ленты (pub_date, post_id)
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="timeline_user_pub_post_idx"),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые обновляются при записи."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name="stats")
+    followers = models.IntegerField(default=0, db_index=True)
+    following = models.IntegerField(default=0)
+    posts = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+
+
+class StoredFile(models.Model):
+    """Файл хранилища картинок и число постов, которые на него ссылаются.
+
+    Одинаковые загрузки лежат в одном файле (posts.storage), поэтому
+    удалить файл можно, только когда ссылок не осталось.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    references = models.IntegerField(default=0)
+
+
+class ImageJob(models.Model):
+    """Задача обработки загруженной картинки в очереди.
+
+    task - путь к функции уровня модуля, которая получает имя файла
+    (posts.thumbnails.generate, posts.variants.generate). Очередь
+    разбирает команда process_images, а не веб-воркеры.
+    """
+    name = models.CharField(max_length=255)
+    task = models.CharField(max_length=200)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("name", "task")
+
+
+class BulkJob(models.Model):
+    """Массовая операция админки в очереди.
+
+    task - путь к функции уровня модуля, args - её аргументы в JSON.
+    Очередь разбирает команда process_bulk_jobs: операция переживает
+    перезапуск веб-воркера, который её поставил.
+    """
+    task = models.CharField(max_length=200)
+    args = models.TextField(default="[]")
+    created = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,76 @@
+"""Кеш отдельных постов и пользователей для пакетной выборки.
+
+В кеше лежат строки values() со всеми полями API, по ключу на объект:
+пачка объектов читается одним get_many, а промахи - одним запросом на
+модель и сохраняются одним set_many (ненайденные не кешируются).
+Пользователей ищут по имени, поэтому рядом хранится ещё имя -> id;
+после переименования старое имя просто перестаёт совпадать с именем в
+строке и ищется в базе заново.
+
+Строки удаляются из кеша там, где меняются их данные: сигналы постов,
+комментариев, групп и пользователей, счётчики posts.stats и перенос
+картинок posts.media. Удаление откладывается до фиксации транзакции:
+иначе параллельный запрос успеет положить в кеш ещё старую строку.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Post, User
+
+OBJECT_CACHE_TIMEOUT = getattr(settings, "OBJECT_CACHE_TIMEOUT", 60 * 60)
+
+
+def post_key(pk):
+    return f"object:post:{pk}"
+
+
+def user_key(pk):
+    return f"object:user:{pk}"
+
+
+def username_key(username):
+    return f"object:username:{username}"
+
+
+def get_posts(ids, lookups):
+    """{id: строка values()} найденных постов."""
+    keys = {post_key(pk): pk for pk in ids}
+    rows = {keys[key]: row for key, row in cache.get_many(keys).items()}
+    missing = [pk for pk in ids if pk not in rows]
+    if missing:
+        fetched = {row["pk"]: row for row in Post.objects
+                   .filter(pk__in=missing).order_by()
+                   .values("pk", *lookups)}
+        cache.set_many({post_key(pk): row for pk, row in fetched.items()},
+                       OBJECT_CACHE_TIMEOUT)
+        rows.update(fetched)
+    return rows
+
+
+def get_users(usernames, lookups):
+    """{имя: строка values()} найденных пользователей."""
+    user_ids = cache.get_many([username_key(name) for name in usernames])
+    cached = cache.get_many([user_key(pk) for pk in user_ids.values()])
+    rows = {row["username"]: row for row in cached.values()}
+    missing = [name for name in usernames if name not in rows]
+    if missing:
+        fetched = {row["username"]: row for row in User.objects
+                   .filter(username__in=missing).order_by()
+                   .values("pk", "username", *lookups)}
+        entries = {username_key(name): row["pk"]
+                   for name, row in fetched.items()}
+        entries.update((user_key(row["pk"]), row) for row in fetched.values())
+        cache.set_many(entries, OBJECT_CACHE_TIMEOUT)
+        rows.update(fetched)
+    return rows
+
+
+def forget_posts(ids):
+    keys = [post_key(pk) for pk in ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_users(ids):
+    keys = [user_key(pk) for pk in ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
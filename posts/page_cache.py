@@ -0,0 +1,80 @@
+"""Кеш страниц целиком.
+
+Оболочка страницы - HTML с метками вместо личных фрагментов (см.
+posts.holes) - одна на всех зрителей и кешируется по состоянию страницы
+из posts.conditional: правка, комментарий или новый пост меняют
+состояние, а значит, и ключ. Анонимам отдаётся закешированный ответ
+целиком, вошедшим - оболочка с дорисованными для них фрагментами.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+from .caching import fragment_key
+from .holes import personalize
+from .thumbnails import is_pending
+
+PAGE_CACHE_TIMEOUT = getattr(settings, "PAGE_CACHE_TIMEOUT", 300)
+
+
+def render_shell(request, template_name, context):
+    """Рендерит оболочку страницы и заполняет её для текущего зрителя."""
+    shell = render_to_string(template_name, {**context, "page_shell": True},
+                             request)
+    response = HttpResponse(personalize(shell, request))
+    response.shell = shell
+    return response
+
+
+def _replay(content, headers):
+    response = HttpResponse(content)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def cache_page_shell(state_func):
+    """Кеширует ответы представления, которое рендерит через render_shell.
+
+    state_func получает аргументы представления и возвращает состояние
+    страницы, не зависящее от зрителя, или None, если кешировать нечего.
+    Анонимный ответ кешируется вместе с заголовками и отдаётся с ними же;
+    ETag и Last-Modified на него ставит condition() по тому же состоянию.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            state = state_func(request, *args, **kwargs)
+            if state is None:
+                return view(request, *args, **kwargs)
+
+            anonymous = not request.user.is_authenticated
+            page_key = fragment_key("page", state)
+            if anonymous:
+                cached = cache.get(page_key)
+                if cached is not None:
+                    return _replay(*cached)
+
+            shell_key = fragment_key("shell", state)
+            shell = cache.get(shell_key)
+            if shell is None:
+                response = view(request, *args, **kwargs)
+                shell = getattr(response, "shell", None)
+                if shell is None or response.status_code != 200:
+                    return response
+                if is_pending(shell):
+                    return response
+                cache.set(shell_key, shell, PAGE_CACHE_TIMEOUT)
+            else:
+                response = HttpResponse(personalize(shell, request))
+            if anonymous:
+                cache.set(page_key, (response.content, dict(response.items())),
+                          PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
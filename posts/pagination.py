@@ -0,0 +1,242 @@
+import base64
+import binascii
+
+from django.core.paginator import Page, Paginator
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+POSTS_PER_PAGE = 10
+
+
+def encode_cursor(pub_date, pk):
+    raw = f"{pub_date.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def row_cursor(row):
+    """Курсор поста или строки values() с pub_date и pk."""
+    if isinstance(row, dict):
+        return encode_cursor(row["pub_date"], row["pk"])
+    return encode_cursor(row.pub_date, row.pk)
+
+
+def decode_cursor(token):
+    """Возвращает пару (pub_date, id) или None для битого токена."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        stamp, pk = raw.rsplit("|", 1)
+        pub_date = parse_datetime(stamp)
+        pk = int(pk)
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class CursorPage:
+    """Страница ленты, выбранная по ключу (pub_date, id) без OFFSET."""
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return page_cursors(self)[1]
+
+    @property
+    def previous_cursor(self):
+        return page_cursors(self)[0]
+
+
+class CursorPaginator:
+    """Пагинация по ключу (pub_date, id).
+
+    Каждая страница - это ограниченный диапазон индекса, поэтому её
+    стоимость не зависит от глубины, и COUNT(*) не нужен.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def get_page(self, after=None, before=None):
+        if before is not None:
+            pub_date, pk = before
+            rows = list(
+                self.object_list.filter(Q(pub_date__gt=pub_date) |
+                                        Q(pub_date=pub_date, pk__gt=pk))
+                .order_by("pub_date", "pk")[:self.per_page + 1]
+            )
+            if not rows:
+                return self.get_page()
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return CursorPage(rows, has_next=True, has_previous=has_previous)
+
+        queryset = self.object_list.order_by("-pub_date", "-pk")
+        if after is not None:
+            pub_date, pk = after
+            queryset = queryset.filter(Q(pub_date__lt=pub_date) |
+                                       Q(pub_date=pub_date, pk__lt=pk))
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], has_next=has_next,
+                          has_previous=after is not None)
+
+
+def estimate_count(model):
+    """Примерное число строк таблицы без COUNT(*)."""
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class "
+                           "WHERE relname = %s", [model._meta.db_table])
+            row = cursor.fetchone()
+        # до первого ANALYZE статистики нет
+        if row is not None and row[0] > 0:
+            return row[0]
+    # наибольший ключ берётся из индекса и оценивает число строк сверху
+    return model._default_manager.aggregate(last=Max("pk"))["last"] or 0
+
+
+class ApproximatePaginator(Paginator):
+    """Paginator, который не считает строки больших таблиц целиком.
+
+    Точно считаются только первые EXACT_LIMIT строк. Если их больше, для
+    выборки без фильтров берётся оценка размера таблицы, а для
+    отфильтрованной - сам предел: дальше листать и не нужно.
+    """
+    EXACT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        count = queryset[:self.EXACT_LIMIT + 1].count()
+        if count <= self.EXACT_LIMIT:
+            return count
+        if not queryset.query.where:
+            return max(estimate_count(queryset.model), count)
+        return self.EXACT_LIMIT
+
+
+def feed_page(post_list, number, per_page=POSTS_PER_PAGE):
+    """(paginator, page) страницы number ленты без COUNT(*).
+
+    Шаблоны и тесты ждут именно Paginator и Page, поэтому это не
+    подклассы. Выбирается на строку больше страницы, и count у
+    Paginator (cached_property) заменяется нижней границей: постов не
+    меньше, чем до конца страницы плюс следующий. has_next() и
+    has_previous() по ней верны, а точное число ленте не нужно - дальше
+    она листается курсором.
+    """
+    try:
+        number = max(int(number), 1)
+    except (TypeError, ValueError):
+        number = 1
+    offset = (number - 1) * per_page
+    rows = list(post_list[offset:offset + per_page + 1])
+    if not rows and number > 1:
+        # страницы уже нет - как Paginator.get_page, не падаем
+        number, offset = 1, 0
+        rows = list(post_list[:per_page + 1])
+    paginator = Paginator(post_list, per_page)
+    paginator.__dict__["count"] = offset + len(rows)
+    return paginator, Page(rows[:per_page], number, paginator)
+
+
+def page_window(page, on_each_side=2, on_ends=1):
+    """Номера страниц вокруг текущей и по краям, None - пропуск.
+
+    Для ленты в 100 000 страниц пейджер выводит десяток ссылок, а не
+    каждую страницу.
+    """
+    num_pages = page.paginator.num_pages
+    number = page.number
+    if num_pages <= (on_each_side + on_ends) * 2 + 1:
+        return list(range(1, num_pages + 1))
+    window = []
+    if number > on_each_side + on_ends + 2:
+        window += list(range(1, on_ends + 1)) + [None]
+        window += list(range(number - on_each_side, number + 1))
+    else:
+        window += list(range(1, number + 1))
+    if number < num_pages - on_each_side - on_ends - 1:
+        window += list(range(number + 1, number + on_each_side + 1)) + [None]
+        window += list(range(num_pages - on_ends + 1, num_pages + 1))
+    else:
+        window += list(range(number + 1, num_pages + 1))
+    return window
+
+
+def page_cursors(page):
+    """Курсоры (предыдущей, следующей) страницы ленты для пейджера.
+
+    Работает и для CursorPage, и для Page обычного Paginator: с первой
+    страницы (и со старых ссылок ?page=N) лента листается дальше
+    курсором, без OFFSET.
+    """
+    if not len(page):
+        return None, None
+    previous = row_cursor(page[0]) if page.has_previous() else None
+    following = row_cursor(page[len(page) - 1]) if page.has_next() else None
+    return previous, following
+
+
+def paginate(request, post_list, per_page=POSTS_PER_PAGE):
+    """Возвращает (paginator, page) для ленты.
+
+    С параметрами ?after=/?before= лента листается курсором, иначе -
+    обычным Paginator: это первая страница или старая ссылка ?page=N,
+    а пейджер с любой из них ведёт дальше курсором (page_cursors).
+    COUNT(*) ленты не выполняется ни в одном из режимов (feed_page).
+
+    Страница запоминается на запросе: её уже выбрал для ETag
+    posts.conditional, и представление не листает ленту второй раз.
+    """
+    if not hasattr(request, "_feed_page"):
+        request._feed_page = _paginate(request, post_list, per_page)
+    return request._feed_page
+
+
+def _paginate(request, post_list, per_page):
+    if "after" in request.GET or "before" in request.GET:
+        paginator = CursorPaginator(post_list, per_page)
+        after = before = None
+        if "before" in request.GET:
+            before = decode_cursor(request.GET["before"])
+        else:
+            after = decode_cursor(request.GET["after"])
+        return paginator, paginator.get_page(after=after, before=before)
+
+    number = request.GET.get("page")
+    if not getattr(post_list, "supports_offset", True):
+        # ленты без OFFSET (timeline.MergedFeed) по старым ссылкам
+        # ?page=N открываются с первой страницы, дальше - курсором
+        number = 1
+    return feed_page(post_list, number, per_page)
@@ -0,0 +1,164 @@
+"""Полнотекстовый поиск по постам.
+
+Индекс - отдельная таблица posts_search: в SQLite виртуальная таблица
+FTS5, в PostgreSQL столбец tsvector с GIN-индексом (см. миграцию
+0018_post_search). В документ поста входят текст, название группы и имя
+автора. Сигналы постов обновляют индекс в той же транзакции, что и сам
+пост, а команда rebuild_search_index строит его заново.
+"""
+from django.db import connection
+
+from .models import Post
+from .stemmer import WORD_RE, stem, stem_text
+
+BATCH_SIZE = 500
+# веса текста, названия группы и имени автора в ранжировании
+WEIGHTS = (1.0, 0.5, 0.5)
+MAX_TERMS = 10
+
+
+def _rows(post_ids):
+    return Post.objects.filter(pk__in=post_ids) \
+        .values_list("pk", "text", "group__title", "author__username")
+
+
+def _remove(cursor, post_ids):
+    placeholders = ",".join(["%s"] * len(post_ids))
+    column = "rowid" if connection.vendor == "sqlite" else "post_id"
+    cursor.execute(f"DELETE FROM posts_search WHERE {column} IN "
+                   f"({placeholders})", list(post_ids))
+
+
+def index_posts(post_ids):
+    """Добавляет посты в индекс или обновляет их документы."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            # FTS5 хранит основы слов: русский стеммер в SQLite свой
+            rows = [(pk, stem_text(text), stem_text(title), username.lower())
+                    for pk, text, title, username in _rows(post_ids)]
+            _remove(cursor, post_ids)
+            cursor.executemany(
+                "INSERT INTO posts_search (rowid, text, group_title, author) "
+                "VALUES (%s, %s, %s, %s)", rows)
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                "INSERT INTO posts_search (post_id, document) "
+                "SELECT p.id, "
+                "setweight(to_tsvector('russian', p.text), 'A') || "
+                "setweight(to_tsvector('russian', coalesce(g.title, '')), 'B') || "
+                "setweight(to_tsvector('simple', u.username), 'B') "
+                "FROM posts_post p JOIN auth_user u ON u.id = p.author_id "
+                "LEFT JOIN posts_group g ON g.id = p.group_id "
+                "WHERE p.id = ANY(%s) "
+                "ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document",
+                [post_ids])
+
+
+def remove_posts(post_ids):
+    post_ids = list(post_ids)
+    if not post_ids or connection.vendor not in ("sqlite", "postgresql"):
+        return
+    with connection.cursor() as cursor:
+        _remove(cursor, post_ids)
+
+
+def reindex(queryset, batch_size=BATCH_SIZE):
+    """Обновляет документы постов из queryset пачками по первичному ключу."""
+    last_pk = 0
+    total = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_pk).order_by("pk")
+                   .values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return total
+        index_posts(ids)
+        total += len(ids)
+        last_pk = ids[-1]
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    if connection.vendor in ("sqlite", "postgresql"):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM posts_search")
+    return reindex(Post.objects.all(), batch_size)
+
+
+def _fts_query(query):
+    # слова запроса берутся как основы с префиксным поиском; кавычки и
+    # операторы FTS5 из пользовательского ввода не доходят до MATCH
+    terms = [stem(word) for word in WORD_RE.findall(query)[:MAX_TERMS]]
+    return " ".join(f'"{term}"*' for term in terms if term)
+
+
+class SearchResults:
+    """Найденные посты по убыванию релевантности.
+
+    Ленивая последовательность для Paginator: count() и срез - по
+    запросу к индексу, посты страницы - одним запросом к posts_post.
+    """
+
+    def __init__(self, query):
+        self.query = query.strip()
+        if connection.vendor == "sqlite":
+            self._match = _fts_query(self.query)
+        else:
+            self._match = self.query
+
+    def _execute(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def count(self):
+        if not self._match:
+            return 0
+        if connection.vendor == "sqlite":
+            sql = ("SELECT COUNT(*) FROM posts_search "
+                   "WHERE posts_search MATCH %s")
+        elif connection.vendor == "postgresql":
+            sql = ("SELECT COUNT(*) FROM posts_search "
+                   "WHERE document @@ plainto_tsquery('russian', %s)")
+        else:
+            return Post.objects.filter(text__icontains=self._match).count()
+        return self._execute(sql, [self._match])[0][0]
+
+    def ids(self, offset, limit):
+        if connection.vendor == "sqlite":
+            # bm25() тем меньше, чем документ релевантнее
+            weights = ", ".join(str(weight) for weight in WEIGHTS)
+            sql = ("SELECT rowid FROM posts_search "
+                   "WHERE posts_search MATCH %s "
+                   f"ORDER BY bm25(posts_search, {weights}), rowid DESC "
+                   "LIMIT %s OFFSET %s")
+        elif connection.vendor == "postgresql":
+            sql = ("SELECT post_id FROM posts_search, "
+                   "plainto_tsquery('russian', %s) query "
+                   "WHERE document @@ query "
+                   "ORDER BY ts_rank(document, query) DESC, post_id DESC "
+                   "LIMIT %s OFFSET %s")
+        else:
+            return list(Post.objects.filter(text__icontains=self._match)
+                        .order_by("-pk")
+                        .values_list("pk", flat=True)[offset:offset + limit])
+        return [row[0] for row in
+                self._execute(sql, [self._match, limit, offset])]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not self._match:
+            return []
+        offset = index.start or 0
+        ids = self.ids(offset, index.stop - offset)
+        posts = Post.objects.feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+    def __len__(self):
+        return self.count()
+
+
+def search(query):
+    return SearchResults(query)
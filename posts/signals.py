@@ -0,0 +1,234 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (caching, media, object_cache, search, stats, thumbnails,
+               timeline, variants)
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_invalidation():
+    """Копит сброс лент и выполняет его один раз при выходе.
+
+    Для массовых операций: ленты автора сбрасываются однократно, а не
+    на каждый его пост. Внутри транзакции сброс ждёт её фиксации, иначе
+    ленты успели бы закешировать ещё не удалённые строки.
+    """
+    _deferred.namespaces = set()
+    try:
+        yield
+    finally:
+        namespaces = _deferred.namespaces
+        del _deferred.namespaces
+        transaction.on_commit(lambda: caching.bump(*namespaces))
+
+
+def invalidate_feeds(post, group_ids=()):
+    """Сбрасывает ленты, в которых есть (или был) пост.
+
+    Ленты подписок сбрасываются только при рассылке и удалении постов
+    (posts.timeline): правка поста меняет лишь его карточку.
+    """
+    _bump(_post_namespaces(post, group_ids))
+
+
+def invalidate_comments(post):
+    """Сбрасывает состояние лент поста после изменения его комментариев.
+
+    Фрагменты лент и число постов от комментариев не зависят, поэтому
+    сбрасываются только пространства имён комментариев этих лент.
+    """
+    _bump([caching.comments_namespace(namespace)
+           for namespace in _post_namespaces(post, (post.group_id,))])
+
+
+def _post_namespaces(post, group_ids):
+    namespaces = [caching.index_namespace(),
+                  caching.profile_namespace(post.author_id)]
+    namespaces += [caching.group_namespace(group_id)
+                   for group_id in set(group_ids) if group_id]
+    return namespaces
+
+
+def _bump(namespaces):
+    deferred = getattr(_deferred, "namespaces", None)
+    if deferred is not None:
+        deferred.update(namespaces)
+        return
+    caching.bump(*namespaces)
+
+
+def _refresh_author_posts(user_id):
+    posts = Post.objects.filter(author_id=user_id)
+    search.reindex(posts)
+    object_cache.forget_posts(posts.values_list("pk", flat=True))
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields, **kwargs):
+    # save() без update_fields идёт и при каждом входе на сайт
+    instance._old_username = None
+    if instance.pk is not None and (update_fields is None
+                                    or "username" in update_fields):
+        instance._old_username = User.objects.filter(pk=instance.pk) \
+            .values_list("username", flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+        return
+    object_cache.forget_users([instance.pk])
+    old_username = getattr(instance, "_old_username", None)
+    if old_username is None or old_username == instance.username:
+        return
+    # имя автора входит в поисковые документы и строки его постов;
+    # постов может быть много, поэтому обновляем их в фоне
+    from . import bulk
+    user_id = instance.pk
+    transaction.on_commit(
+        lambda: bulk.schedule(_refresh_author_posts, user_id))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    object_cache.forget_users([instance.pk])
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    # группу до правки нужно знать, чтобы сбросить и её ленту
+    instance._old_group_id = None
+    instance._old_image = ""
+    stored = None
+    if instance.pk is not None:
+        stored = Post.objects.filter(pk=instance.pk) \
+            .values_list("group_id", "image").first()
+    if stored is not None:
+        instance._old_group_id, instance._old_image = stored
+        # новая версия сбрасывает закешированную карточку поста
+        instance.version = F("version") + 1
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(instance.author_id, posts=1)
+        timeline.push_post(instance)
+    else:
+        instance.refresh_from_db(fields=["version"])
+    search.index_posts([instance.pk])
+    object_cache.forget_posts([instance.pk])
+    if (instance.image.name or "") != (instance._old_image or ""):
+        if instance.image:
+            media.acquire(instance.image.name)
+        if instance._old_image:
+            media.release(instance._old_image)
+    if instance.image and instance.image.name != instance._old_image:
+        # варианты картинки строим заранее, а не в первом запросе к карточке
+        name = instance.image.name
+        transaction.on_commit(
+            lambda: thumbnails.schedule(name, variants.generate))
+    invalidate_feeds(instance, (instance.group_id, instance._old_group_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    stats.bump(instance.author_id, create=False, posts=-1)
+    if instance.image:
+        media.release(instance.image.name)
+    search.remove_posts([instance.pk])
+    object_cache.forget_posts([instance.pk])
+    timeline.drop_post(instance)
+    invalidate_feeds(instance, (instance.group_id,))
+
+
+def _refresh_group_posts(group_id):
+    posts = Post.objects.filter(group_id=group_id)
+    search.reindex(posts)
+    object_cache.forget_posts(posts.values_list("pk", flat=True))
+
+
+@receiver(pre_save, sender=Group)
+def group_saving(sender, instance, **kwargs):
+    instance._old_names = None
+    if instance.pk is not None:
+        instance._old_names = Group.objects.filter(pk=instance.pk) \
+            .values_list("title", "slug").first()
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # название группы входит в поисковые документы её постов, а slug -
+    # в их строки в object_cache; правка описания их не касается
+    if created or instance._old_names == (instance.title, instance.slug):
+        return
+    # bulk импортирует этот модуль
+    from . import bulk
+    # в группе могут быть тысячи постов: обновляем их в фоне, после
+    # фиксации, а не в запросе админки
+    group_id = instance.pk
+    transaction.on_commit(
+        lambda: bulk.schedule(_refresh_group_posts, group_id))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    instance._post_ids = list(instance.posts.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    search.reindex(Post.objects.filter(pk__in=instance._post_ids))
+    object_cache.forget_posts(instance._post_ids)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id) \
+            .update(comment_count=F("comment_count") + 1, modified=Now())
+        object_cache.forget_posts([instance.post_id])
+        stats.bump(instance.author_id, comments=1)
+        # число комментариев входит в состояние лент поста
+        invalidate_comments(instance.post)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id) \
+        .update(comment_count=F("comment_count") - 1, modified=Now())
+    object_cache.forget_posts([instance.post_id])
+    stats.bump(instance.author_id, create=False, comments=-1)
+    post = Post.objects.filter(pk=instance.post_id) \
+        .only("author_id", "group_id").first()
+    if post is not None:
+        invalidate_comments(post)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(instance.user_id, following=1)
+        stats.bump(instance.author_id, followers=1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        caching.bump(caching.follow_namespace(instance.user_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.bump(instance.user_id, create=False, following=-1)
+    stats.bump(instance.author_id, create=False, followers=-1)
+    timeline.remove_author(instance.user_id, instance.author_id)
+    caching.bump(caching.follow_namespace(instance.user_id))
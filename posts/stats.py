@@ -0,0 +1,45 @@
+from django.db.models import Count, F
+
+from . import object_cache
+from .models import Comment, Follow, Post, User, UserStats
+
+BATCH_SIZE = 1000
+
+
+def bump(user_id, create=True, **deltas):
+    """Атомарно меняет счётчики пользователя на deltas через F()."""
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if not UserStats.objects.filter(user_id=user_id).update(**updates):
+        if not create:
+            return
+        UserStats.objects.get_or_create(user_id=user_id)
+        UserStats.objects.filter(user_id=user_id).update(**updates)
+    object_cache.forget_users([user_id])
+
+
+def _totals(queryset, field, user_ids):
+    return dict(queryset.filter(**{f"{field}__in": user_ids})
+                .order_by().values(field).annotate(total=Count("pk"))
+                .values_list(field, "total"))
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Пересчитывает счётчики всех пользователей пачками."""
+    user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        followers = _totals(Follow.objects, "author", batch)
+        following = _totals(Follow.objects, "user", batch)
+        posts = _totals(Post.objects, "author", batch)
+        comments = _totals(Comment.objects, "author", batch)
+        rows = [UserStats(user_id=user_id,
+                          followers=followers.get(user_id, 0),
+                          following=following.get(user_id, 0),
+                          posts=posts.get(user_id, 0),
+                          comments=comments.get(user_id, 0))
+                for user_id in batch]
+        UserStats.objects.bulk_create(rows, ignore_conflicts=True)
+        UserStats.objects.bulk_update(
+            rows, ["followers", "following", "posts", "comments"])
+        object_cache.forget_users(batch)
+    return len(user_ids)
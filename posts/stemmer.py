@@ -0,0 +1,100 @@
+"""Стеммер Портера (Snowball) для русского языка.
+
+Нужен поиску по SQLite: FTS5 умеет только английский porter, поэтому
+в индекс и в запрос попадают уже выделенные основы слов. PostgreSQL
+делает то же самое сам словарём russian.
+"""
+import re
+
+WORD_RE = re.compile(r"\w+")
+VOWELS = set("аеиоуыэюя")
+
+PERFECTIVE_GERUND = (("в", "вши", "вшись"),
+                     ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+ADJECTIVE = ((), ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый",
+                  "ой", "ем", "им", "ым", "ом", "его", "ого", "ему", "ому",
+                  "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"))
+PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+REFLEXIVE = ((), ("ся", "сь"))
+VERB = (("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но",
+         "ет", "ют", "ны", "ть", "ешь", "нно"),
+        ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей",
+         "уй", "ил", "ыл", "им", "ым", "ен", "ило", "ыло", "ено", "ят",
+         "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю"))
+NOUN = ((), ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи",
+             "ии", "и", "ией", "ей", "ой", "ий", "й", "иям", "ям", "ием",
+             "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию",
+             "ью", "ю", "ия", "ья", "я"))
+SUPERLATIVE = ((), ("ейше", "ейш"))
+DERIVATIONAL = ((), ("ость", "ост"))
+
+
+def _region(word, start):
+    """Начало области после первой согласной, следующей за гласной."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(word, start, groups):
+    """Отрезает самое длинное окончание, целиком лежащее после start.
+
+    Окончания первой группы должны идти после «а» или «я», которые
+    остаются в слове. Возвращает слово без окончания или None.
+    """
+    best = None
+    for group, endings in enumerate(groups):
+        for ending in endings:
+            if word.endswith(ending) and len(word) - len(ending) >= start \
+                    and (best is None or len(ending) > len(best[1])):
+                best = group, ending
+    if best is None:
+        return None
+    group, ending = best
+    stem = word[:-len(ending)]
+    if group == 0 and (len(stem) <= start or stem[-1] not in "ая"):
+        return None
+    return stem
+
+
+def stem(word):
+    word = word.lower().replace("ё", "е")
+    rv = next((i + 1 for i, letter in enumerate(word) if letter in VOWELS),
+              len(word))
+    r2 = _region(word, _region(word, 0))
+
+    # шаг 1
+    stripped = _strip(word, rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stripped = _strip(word, rv, ADJECTIVE)
+        if stripped is not None:
+            stripped = _strip(stripped, rv, PARTICIPLE) or stripped
+        else:
+            stripped = _strip(word, rv, VERB) or _strip(word, rv, NOUN)
+    word = stripped if stripped is not None else word
+
+    # шаг 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # шаг 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+
+    # шаг 4
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        return word[:-1]
+    stripped = _strip(word, rv, SUPERLATIVE)
+    if stripped is not None:
+        if stripped.endswith("нн") and len(stripped) - 2 >= rv:
+            stripped = stripped[:-1]
+        return stripped
+    if word.endswith("ь") and len(word) - 1 >= rv:
+        return word[:-1]
+    return word
+
+
+def stem_text(text):
+    """Текст из основ его слов, через пробел."""
+    return " ".join(stem(word) for word in WORD_RE.findall(text or ""))
@@ -0,0 +1,90 @@
+"""Хранилище картинок постов, адресуемое содержимым.
+
+Имя файла - SHA-256 его содержимого, разложенный по вложенным папкам:
+posts/ab/cd/abcdef....jpg. Так в одной папке не скапливаются миллионы
+файлов, а повторная загрузка той же картинки не занимает места:
+файл с таким именем уже лежит на диске. Сколько постов ссылается на
+файл, считает posts.media.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_NAME_RE = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+
+
+def content_name(directory, digest, extension):
+    return os.path.join(directory, digest[:2], digest[2:4],
+                        digest + extension.lower())
+
+
+def is_content_name(name):
+    return bool(HASH_NAME_RE.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # одинаковое имя означает одинаковое содержимое, переименовывать
+        # нечего; настоящее имя выбирает _save
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, filename = os.path.split(name)
+        name = content_name(directory, digest.hexdigest(),
+                            os.path.splitext(filename)[1])
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # пишем во временный файл рядом и атомарно переименовываем:
+        # читатели не видят недописанный файл, а одновременная загрузка
+        # той же картинки просто заменит файл таким же
+        if hasattr(content, "temporary_file_path"):
+            file_move_safe(content.temporary_file_path(), full_path,
+                           allow_overwrite=True)
+        else:
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(full_path))
+            try:
+                with os.fdopen(fd, "wb") as output:
+                    for chunk in content.chunks():
+                        output.write(chunk)
+                os.replace(temporary, full_path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+        # mkstemp создаёт файл с правами 0600, веб-сервер его не прочтёт
+        os.chmod(full_path, self.file_permissions_mode or 0o644)
+        return name
+
+    def adopt(self, name):
+        """Переносит уже лежащий в хранилище файл под его адрес по
+        содержимому и возвращает новое имя. Файл не копируется, а
+        переименовывается; если такой уже есть, старый удаляется."""
+        if is_content_name(name):
+            return name
+        digest = hashlib.sha256()
+        with self.open(name) as source:
+            for chunk in source.chunks():
+                digest.update(chunk)
+        directory, filename = os.path.split(name)
+        new_name = content_name(directory, digest.hexdigest(),
+                                os.path.splitext(filename)[1])
+        new_path = self.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        if os.path.exists(new_path):
+            self.delete(name)
+        else:
+            os.replace(self.path(name), new_path)
+        return new_name
@@ -0,0 +1,86 @@
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.db.models import Max, Min
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+register = template.Library()
+
+
+def _local(value):
+    if value is not None and timezone.is_aware(value):
+        return timezone.localtime(value)
+    return value
+
+
+@register.inclusion_tag("admin/date_hierarchy.html")
+def indexed_date_hierarchy(cl):
+    """date_hierarchy админки без SELECT DISTINCT по всей таблице.
+
+    Стандартный тег перечисляет годы, месяцы и дни через
+    queryset.dates(), то есть проходом по всем строкам. Здесь границы
+    берутся из MIN/MAX по индексу даты, а между ними перечисляются все
+    периоды подряд, в том числе пустые.
+    """
+    field_name = cl.date_hierarchy
+    year_field = f"{field_name}__year"
+    month_field = f"{field_name}__month"
+    day_field = f"{field_name}__day"
+    year_lookup = cl.params.get(year_field)
+    month_lookup = cl.params.get(month_field)
+    if year_lookup and month_lookup and cl.params.get(day_field):
+        # выбранный день стандартный тег показывает без запросов
+        return date_hierarchy(cl)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f"{field_name}__"])
+
+    date_range = cl.queryset.aggregate(first=Min(field_name),
+                                       last=Max(field_name))
+    first, last = _local(date_range["first"]), _local(date_range["last"])
+    if not (year_lookup or month_lookup) and first and last:
+        if first.year == last.year:
+            year_lookup = first.year
+            if first.month == last.month:
+                month_lookup = first.month
+
+    if year_lookup and month_lookup:
+        days = []
+        if first and last:
+            days = [first.date() + datetime.timedelta(days=offset)
+                    for offset in range((last.date() - first.date()).days + 1)]
+        return {
+            "show": True,
+            "back": {"link": link({year_field: year_lookup}),
+                     "title": str(year_lookup)},
+            "choices": [{
+                "link": link({year_field: year_lookup,
+                              month_field: month_lookup, day_field: day.day}),
+                "title": capfirst(formats.date_format(day, "MONTH_DAY_FORMAT")),
+            } for day in days],
+        }
+    if year_lookup:
+        months = []
+        if first and last:
+            months = [datetime.date(int(year_lookup), month, 1)
+                      for month in range(first.month, last.month + 1)]
+        return {
+            "show": True,
+            "back": {"link": link({}), "title": _("All dates")},
+            "choices": [{
+                "link": link({year_field: year_lookup,
+                              month_field: month.month}),
+                "title": capfirst(formats.date_format(month,
+                                                      "YEAR_MONTH_FORMAT")),
+            } for month in months],
+        }
+    years = range(first.year, last.year + 1) if first and last else ()
+    return {
+        "show": True,
+        "back": None,
+        "choices": [{"link": link({year_field: str(year)}),
+                     "title": str(year)} for year in years],
+    }
@@ -0,0 +1,42 @@
+from django import template
+from django.core.cache import cache
+
+from posts.caching import fragment_key, get_or_compute
+from posts.thumbnails import is_pending
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, name, key):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.key = key
+
+    def render(self, context):
+        timeout = int(self.timeout.resolve(context))
+        key = fragment_key(self.name, self.key.resolve(context))
+        html = get_or_compute(key, lambda: self.nodelist.render(context),
+                              timeout)
+        if is_pending(html):
+            # миниатюры ещё строятся - в следующий раз отрендерим заново
+            cache.delete(key)
+        return html
+
+
+@register.tag
+def feedcache(parser, token):
+    """{% feedcache timeout name key %}...{% endfeedcache %}
+
+    Как {% cache %}, но с защитой от одновременного пересчёта фрагмента
+    (см. posts.caching.get_or_compute).
+    """
+    bits = token.split_contents()
+    if len(bits) != 4:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает три аргумента: timeout name key")
+    nodelist = parser.parse(("endfeedcache",))
+    parser.delete_first_token()
+    return FeedCacheNode(nodelist, parser.compile_filter(bits[1]), bits[2],
+                         parser.compile_filter(bits[3]))
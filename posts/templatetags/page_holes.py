@@ -0,0 +1,18 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.holes import marker, render_hole
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **params):
+    """{% hole "follow" author_id=author.pk username=author.username %}
+
+    Личный фрагмент страницы: в оболочке - метка, иначе - сам фрагмент
+    (см. posts.holes).
+    """
+    if context.get("page_shell"):
+        return mark_safe(marker(name, **params))
+    return mark_safe(render_hole(context.request, name, **params))
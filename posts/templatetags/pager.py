@@ -0,0 +1,17 @@
+from django import template
+
+from posts import pagination
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page):
+    """Номера страниц для пейджера, None - пропуск (см. posts.pagination)."""
+    return pagination.page_window(page)
+
+
+@register.simple_tag
+def page_cursors(page):
+    """(курсор предыдущей, курсор следующей) страницы ленты."""
+    return pagination.page_cursors(page)
@@ -0,0 +1,32 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.cards import render_cards
+from posts.thumbnails import card_thumbnail
+from posts.variants import card_variants
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    return mark_safe("".join(render_cards(posts)))
+
+
+@register.inclusion_tag("includes/card_image.html", takes_context=True)
+def card_image(context, image):
+    """Картинка карточки: адаптивные варианты, если они готовы, иначе
+    миниатюра sorl-thumbnail или заглушка, пока картинка обрабатывается.
+
+    Ленты передают то, что заранее найдено для всей страницы
+    (posts.cards.render_cards), иначе всё ищется здесь.
+    """
+    if "card_variants" in context:
+        variants, pending = context["card_variants"]
+    else:
+        variants, pending = card_variants(image)
+    if variants or pending:
+        return {"variants": variants, "pending": pending}
+    thumbnail, pending = context.get("card_thumbnail") or \
+        card_thumbnail(image)
+    return {"thumbnail": thumbnail, "pending": pending}
@@ -0,0 +1,173 @@
+"""Миниатюры карточек постов.
+
+Загруженная картинка ставится в очередь (модель ImageJob), а пока
+миниатюры нет, карточка показывает заглушку. Очередь разбирает команда
+process_images в своём пуле процессов - веб-воркеры ничего не форкают.
+Рабочие процессы не ходят в базу: они читают оригинал и пишут файл
+миниатюры в хранилище, а запись в key-value store sorl-thumbnail
+делает сама команда, когда задача готова. Готовность карточка узнаёт
+по key-value store, без обращения к хранилищу.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults, settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from .caching import fragment_key
+from .models import ImageJob
+
+CARD_GEOMETRY = "960x339"
+CARD_OPTIONS = {"crop": "center", "upscale": True}
+# процессы команды process_images; 0 - строить прямо в запросе, без
+# очереди (для отладки)
+WORKERS = getattr(settings, "THUMBNAIL_WORKERS", 2)
+# сколько помнить, что картинка уже в очереди, и что её не удалось
+# обработать: потом задача ставится снова
+QUEUED_TIMEOUT = getattr(settings, "IMAGE_QUEUED_TIMEOUT", 60 * 60)
+FAILED_TIMEOUT = getattr(settings, "IMAGE_FAILED_TIMEOUT", 24 * 60 * 60)
+# атрибут заглушки: HTML с ним нельзя класть в кеш
+PENDING_ATTR = "data-thumbnail-pending"
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve(name):
+    """Оригинал, файл миниатюры и опции - так же, как их вычисляет
+    ThumbnailBackend.get_thumbnail, но без обращения к key-value store."""
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(CARD_OPTIONS)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault("format", backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(defaults, attr):
+            options.setdefault(key, value)
+    thumbnail = ImageFile(
+        backend._get_thumbnail_filename(source, CARD_GEOMETRY, options),
+        default.storage)
+    return source, thumbnail, options
+
+
+def generate(name):
+    """Строит миниатюру карточки; выполняется в рабочем процессе."""
+    source, thumbnail, options = _resolve(name)
+    if thumbnail.exists():
+        return thumbnail.name
+    source_image = default.engine.get_image(source)
+    try:
+        options["image_info"] = default.engine.get_image_info(source_image)
+        default.backend._create_thumbnail(source_image, CARD_GEOMETRY,
+                                          options, thumbnail)
+    finally:
+        default.engine.cleanup(source_image)
+    return thumbnail.name
+
+
+def task_path(task):
+    return f"{task.__module__}.{task.__qualname__}"
+
+
+def _queued_key(name, task):
+    return fragment_key("image-queued", (task_path(task), name))
+
+
+def _failed_key(name, task):
+    return fragment_key("image-failed", (task_path(task), name))
+
+
+def has_failed(name, task=generate):
+    return cache.get(_failed_key(name, task)) is not None
+
+
+def mark_failed(name, task, error):
+    cache.delete(_queued_key(name, task))
+    cache.set(_failed_key(name, task), str(error), FAILED_TIMEOUT)
+    logger.warning("Не удалось обработать картинку %s: %s", name, error)
+
+
+def complete(name, task):
+    """Отмечает задачу выполненной; вызывается после task(name)."""
+    cache.delete(_queued_key(name, task))
+    if task is generate:
+        # файл уже есть, get_thumbnail только запишет key-value store
+        get_thumbnail(name, CARD_GEOMETRY, **CARD_OPTIONS)
+
+
+def schedule(name, task=generate):
+    """Ставит обработку картинки в очередь process_images.
+
+    task - функция уровня модуля, которая получает имя файла в
+    хранилище (по умолчанию - построение миниатюры карточки). Пока
+    задача в очереди, повторный вызов не пишет в базу, картинки с
+    ошибкой до истечения FAILED_TIMEOUT не обрабатываются. Возвращает
+    True, если обработка уже закончена (только при WORKERS = 0).
+    """
+    if has_failed(name, task):
+        return True
+    if not WORKERS:
+        try:
+            task(name)
+        except OSError as error:
+            mark_failed(name, task, error)
+        else:
+            complete(name, task)
+        return True
+    if cache.add(_queued_key(name, task), 1, QUEUED_TIMEOUT):
+        ImageJob.objects.bulk_create(
+            [ImageJob(name=name, task=task_path(task))],
+            ignore_conflicts=True)
+    return False
+
+
+def card_thumbnail(image):
+    """Миниатюра карточки, если она готова.
+
+    Возвращает (thumbnail, pending): если миниатюры нет в key-value
+    store, её построение ставится в очередь, и pending=True.
+    """
+    if not image:
+        return None, False
+    if has_failed(image.name):
+        return None, False
+    _, thumbnail, _ = _resolve(image.name)
+    cached = default.kvstore.get(thumbnail)
+    if cached is not None:
+        return cached, False
+    if not schedule(image.name):
+        return None, True
+    if has_failed(image.name):
+        return None, False
+    return get_thumbnail(image, CARD_GEOMETRY, **CARD_OPTIONS), False
+
+
+def prefetch(images):
+    """Миниатюры карточек для всех картинок страницы.
+
+    Возвращает {имя картинки: (thumbnail, pending)}. Метаданные готовых
+    миниатюр (адрес и размеры) читаются из key-value store одним
+    get_many, по одной проверяются только те, которых в нём нет.
+    """
+    images = [image for image in images if image]
+    thumbnails = {image.name: _resolve(image.name)[1] for image in images}
+    kvstore = default.kvstore
+    found = {}
+    if hasattr(kvstore, "get_many"):
+        found = kvstore.get_many(thumbnails.values())
+    result = {}
+    for image in images:
+        thumbnail = found.get(thumbnails[image.name].key)
+        if thumbnail is not None:
+            result[image.name] = thumbnail, False
+        else:
+            result[image.name] = card_thumbnail(image)
+    return result
+
+
+def is_pending(html):
+    return PENDING_ATTR in html
@@ -0,0 +1,263 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count, Q, Subquery
+
+from . import caching
+from .caching import get_or_compute
+from .models import Follow, Post, TimelineEntry, User, UserStats
+
+TIMELINE_LENGTH = getattr(settings, "TIMELINE_LENGTH", 1000)
+# авторы, у которых подписчиков больше порога, не рассылаются по лентам:
+# их посты подмешиваются в ленту при чтении
+FANOUT_FOLLOWER_LIMIT = getattr(settings, "TIMELINE_FANOUT_FOLLOWER_LIMIT",
+                                10000)
+PULL_AUTHORS_CACHE_KEY = "timeline:pull_authors"
+PULL_AUTHORS_TIMEOUT = 300
+BATCH_SIZE = 1000
+
+
+def pull_author_ids():
+    """Множество авторов, чьи посты читаются, а не рассылаются."""
+    def compute():
+        return set(UserStats.objects
+                   .filter(followers__gt=FANOUT_FOLLOWER_LIMIT)
+                   .values_list("user_id", flat=True))
+    return get_or_compute(PULL_AUTHORS_CACHE_KEY, compute,
+                          PULL_AUTHORS_TIMEOUT)
+
+
+def trim(user_id):
+    """Удаляет из ленты всё, что не помещается в TIMELINE_LENGTH."""
+    cutoff = TimelineEntry.objects.filter(user_id=user_id) \
+        .order_by("-pub_date").values("pub_date")[TIMELINE_LENGTH - 1:
+                                                  TIMELINE_LENGTH]
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 pub_date__lt=Subquery(cutoff)).delete()
+
+
+def trim_all(batch_size=BATCH_SIZE):
+    """Обрезает ленты длиннее TIMELINE_LENGTH, обходя пользователей
+    пачками. Возвращает число обрезанных лент."""
+    trimmed = 0
+    last_pk = 0
+    while True:
+        user_ids = list(User.objects.filter(pk__gt=last_pk).order_by("pk")
+                        .values_list("pk", flat=True)[:batch_size])
+        if not user_ids:
+            return trimmed
+        last_pk = user_ids[-1]
+        overflowing = TimelineEntry.objects.filter(user_id__in=user_ids) \
+            .order_by().values("user_id").annotate(entries=Count("pk")) \
+            .filter(entries__gt=TIMELINE_LENGTH) \
+            .values_list("user_id", flat=True)
+        for user_id in overflowing:
+            trim(user_id)
+            # число постов ленты в кеше - по её пространству имён
+            caching.bump(caching.follow_namespace(user_id))
+            trimmed += 1
+
+
+def push_post(post):
+    """Рассылает новый пост в ленты всех подписчиков автора."""
+    if post.author_id in pull_author_ids():
+        return
+    follower_ids = list(Follow.objects.filter(author_id=post.author_id)
+                        .values_list("user_id", flat=True))
+    entries = [TimelineEntry(user_id=user_id, post_id=post.pk,
+                             pub_date=post.pub_date)
+               for user_id in follower_ids]
+    # ленты подписчиков не обрезаются здесь: это по команде DELETE на
+    # подписчика. Лишнее убирает trim_all() по расписанию
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+    # у ленты подписок своя версия: рассылка знает всех получателей
+    caching.bump(*[caching.follow_namespace(user_id)
+                   for user_id in follower_ids])
+
+
+def drop_post(post):
+    """Сбрасывает версии лент, из которых удалён пост.
+
+    Записи лент удаляются каскадом вместе с постом, а правка поста
+    версии лент не трогает: карточки кешируются по версии поста.
+    """
+    if post.author_id in pull_author_ids():
+        return
+    follower_ids = Follow.objects.filter(author_id=post.author_id) \
+        .values_list("user_id", flat=True)
+    caching.bump(*[caching.follow_namespace(user_id)
+                   for user_id in follower_ids])
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if author_id in pull_author_ids():
+        return
+    # самые новые посты - явно, а не по Meta.ordering модели
+    posts = Post.objects.filter(author_id=author_id) \
+        .order_by("-pub_date", "-pk").only("pk", "pub_date")[:TIMELINE_LENGTH]
+    entries = [TimelineEntry(user_id=user_id, post_id=post.pk,
+                             pub_date=post.pub_date)
+               for post in posts]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+    trim(user_id)
+
+
+def remove_author(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+
+
+def _merge_key(post):
+    if isinstance(post, dict):
+        return post["pub_date"], post["pk"]
+    return post.pub_date, post.pk
+
+
+def _entry_lookup(lookup):
+    """Поле поста -> поле записи ленты.
+
+    Ключ курсора (pub_date, id) есть в самой записи, поэтому условия и
+    порядок по нему ложатся на индекс ленты; остальное - через пост.
+    """
+    prefix = "-" if lookup.startswith("-") else ""
+    name = lookup[len(prefix):]
+    field, _, rest = name.partition("__")
+    if field == "pub_date":
+        return lookup
+    if field in ("pk", "id"):
+        return prefix + "post_id" + (f"__{rest}" if rest else "")
+    return f"{prefix}post__{name}"
+
+
+def _entry_q(q):
+    children = [_entry_q(child) if isinstance(child, Q)
+                else (_entry_lookup(child[0]), child[1])
+                for child in q.children]
+    return q._new_instance(children, q.connector, q.negated)
+
+
+class Timeline:
+    """Материализованная лента подписок как последовательность постов.
+
+    Порядок, условия курсора и срезы применяются к записям TimelineEntry
+    пользователя - это диапазон индекса (user, -pub_date, -post), - а
+    посты страницы выбираются вторым запросом по первичному ключу.
+    Поддерживает то же, что MergedFeed, и может быть его источником.
+    """
+
+    def __init__(self, entries, posts):
+        self.entries = entries
+        self.posts = posts
+
+    def filter(self, *args, **kwargs):
+        return Timeline(self.entries.filter(
+            *[_entry_q(q) for q in args],
+            **{_entry_lookup(name): value for name, value in kwargs.items()}),
+            self.posts)
+
+    def exclude(self, *args, **kwargs):
+        return Timeline(self.entries.exclude(
+            *[_entry_q(q) for q in args],
+            **{_entry_lookup(name): value for name, value in kwargs.items()}),
+            self.posts)
+
+    def order_by(self, *fields):
+        return Timeline(self.entries.order_by(
+            *[_entry_lookup(field) for field in fields]), self.posts)
+
+    def values(self, *fields):
+        return Timeline(self.entries, self.posts.values("pk", *fields))
+
+    def count(self):
+        return self.entries.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        ids = list(self.entries.values_list("post_id", flat=True)[key])
+        if not ids:
+            return []
+        posts = {_merge_key(post)[1]: post
+                 for post in self.posts.filter(pk__in=ids).order_by()}
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+class MergedFeed:
+    """Лента, собранная k-way слиянием отсортированных querysets постов.
+
+    Поддерживает то, что нужно Paginator и CursorPaginator: count(),
+    срезы, filter(), order_by() и values(), применяя их к каждому
+    источнику.
+
+    Срез [start:stop] читает stop строк из каждого источника, поэтому
+    такую ленту листают только курсором, где start всегда 0: каждый
+    источник - это per_page + 1 строк после ключа (см. paginate).
+    """
+    # OFFSET стоил бы N * per_page строк из каждого источника
+    supports_offset = False
+
+    def __init__(self, sources, descending=True):
+        self.sources = sources
+        self.descending = descending
+
+    def filter(self, *args, **kwargs):
+        return MergedFeed([source.filter(*args, **kwargs)
+                           for source in self.sources], self.descending)
+
+    def order_by(self, *fields):
+        return MergedFeed([source.order_by(*fields)
+                           for source in self.sources],
+                          fields[0].startswith("-"))
+
+    def values(self, *fields):
+        # слиянию нужны pub_date и pk каждой строки
+        return MergedFeed([source.values("pk", "pub_date", *fields)
+                           for source in self.sources], self.descending)
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        rows = heapq.merge(*(source[:stop] for source in self.sources),
+                           key=_merge_key, reverse=self.descending)
+        return list(islice(rows, start, stop))
+
+
+def followed_pull_authors(user):
+    """Авторы из подписок пользователя, чьи посты читаются напрямую."""
+    return list(Follow.objects.filter(user=user,
+                                      author_id__in=pull_author_ids())
+                .values_list("author_id", flat=True))
+
+
+def timeline_posts(user, pulled=None):
+    """Посты ленты подписок.
+
+    Посты обычных авторов читаются из материализованной ленты, посты
+    авторов с большим числом подписчиков - напрямую по индексу автора.
+    """
+    posts = Post.objects.feed().order_by("-pub_date", "-pk")
+    if pulled is None:
+        pulled = followed_pull_authors(user)
+    # и страницы, и курсор - по индексу ленты (user, -pub_date, -post)
+    pushed = Timeline(TimelineEntry.objects.filter(user=user)
+                      .order_by("-pub_date", "-post_id"), posts)
+    if not pulled:
+        return pushed
+    sources = [pushed.exclude(author_id__in=pulled)]
+    sources += [posts.filter(author_id=author_id) for author_id in pulled]
+    return MergedFeed(sources)
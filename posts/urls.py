@@ -1,12 +1,31 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
+    path("api/posts/", api.index, name="api_index"),
+    path("api/posts/batch/", api.posts_batch, name="api_posts_batch"),
+    path("api/users/batch/", api.users_batch, name="api_users_batch"),
+    path("api/groups/<slug:slug>/posts/", api.group_posts, name="api_group"),
+    path("api/users/<str:username>/posts/", api.profile, name="api_profile"),
+    path("api/follow/posts/", api.follow_index, name="api_follow"),
+    path("api/posts/<int:post_id>/", api.post_view, name="api_post"),
+    path("api/posts/<int:post_id>/comments/", api.post_comments,
+         name="api_comments"),
+    path("api/posts/since/", api.index_since, name="api_index_since"),
+    path("api/groups/<slug:slug>/posts/since/", api.group_since,
+         name="api_group_since"),
+    path("api/users/<str:username>/posts/since/", api.profile_since,
+         name="api_profile_since"),
+    path("api/follow/posts/since/", api.follow_since,
+         name="api_follow_since"),
+    path("api/posts/<int:post_id>/comments/since/", api.comments_since,
+         name="api_comments_since"),
     path("", views.index, name="index"),
     path("group/<slug:slug>", views.group_posts, name="groups"),
     path("new/", views.new_post, name="new_post"),
     path("follow/", views.follow_index, name="follow_index"),
+    path("search/", views.search_posts, name="search"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     path('<str:username>/', views.profile, name='profile'),
@@ -17,5 +36,7 @@ urlpatterns = [
         name='post_edit'
     ),
     path("<username>/<int:post_id>/comment", views.add_comment, name="add_comment"),
+    path("<str:username>/<int:post_id>/comments/", views.post_comments,
+         name="post_comments"),
 
 ]
@@ -0,0 +1,128 @@
+"""Адаптивные варианты картинки поста для <picture>/srcset.
+
+Картинка обрезается под пропорции карточки один раз, после загрузки, и
+сохраняется рядом с оригиналом в нескольких ширинах в WebP и JPEG:
+posts/cat.jpg -> posts/cat.320w.webp, posts/cat.320w.jpg, ...
+Оригинал читается из хранилища поля Post.image, а варианты, как и
+миниатюры sorl-thumbnail, пишутся в default_storage.
+Варианты строит очередь posts.thumbnails (команда process_images),
+рабочие процессы в базу не ходят.
+"""
+import io
+import os
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from . import thumbnails
+from .models import Post
+
+WIDTHS = (320, 640, 960)
+CARD_WIDTH, CARD_HEIGHT = 960, 339
+SIZES = f"(max-width: {CARD_WIDTH}px) 100vw, {CARD_WIDTH}px"
+# JPEG идёт последним: по наибольшему JPEG судим, что готовы все варианты
+FORMATS = (("webp", "WEBP", {"quality": 80, "method": 4}),
+           ("jpg", "JPEG", {"quality": 85, "optimize": True,
+                            "progressive": True}))
+
+source_storage = Post._meta.get_field("image").storage
+
+
+def _formats():
+    return [fmt for fmt in FORMATS
+            if fmt[1] != "WEBP" or features.check("webp")]
+
+
+def _height(width):
+    return round(width * CARD_HEIGHT / CARD_WIDTH)
+
+
+def variant_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f"{root}.{width}w.{extension}"
+
+
+def generate(name, force=False):
+    """Строит все варианты картинки; выполняется в рабочем процессе.
+
+    Возвращает число записанных файлов (0, если варианты уже есть).
+    """
+    if not force and default_storage.exists(
+            variant_name(name, WIDTHS[-1], "jpg")):
+        return 0
+    with source_storage.open(name) as source:
+        image = Image.open(source)
+        # старые оригиналы бывают огромными: JPEG декодируем уменьшенным,
+        # но не меньше ширины карточки при любом повороте по EXIF
+        image.draft("RGB", (CARD_WIDTH, CARD_WIDTH))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        # обрезаем один раз под самую большую ширину, меньшие - из неё
+        card = ImageOps.fit(image, (CARD_WIDTH, CARD_HEIGHT),
+                            Image.Resampling.LANCZOS)
+    written = 0
+    for width in WIDTHS:
+        resized = card if width == CARD_WIDTH else \
+            card.resize((width, _height(width)), Image.Resampling.LANCZOS)
+        for extension, fmt, options in _formats():
+            buffer = io.BytesIO()
+            resized.save(buffer, fmt, **options)
+            target = variant_name(name, width, extension)
+            # хранилище не перезаписывает файлы, а переименовывает новые
+            default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+class CardVariants:
+    """Адреса вариантов картинки для шаблона карточки."""
+    width = CARD_WIDTH
+    height = CARD_HEIGHT
+    sizes = SIZES
+
+    def __init__(self, name):
+        self.name = name
+
+    def _srcset(self, extension):
+        return ", ".join(
+            f"{default_storage.url(variant_name(self.name, width, extension))}"
+            f" {width}w" for width in WIDTHS)
+
+    @property
+    def webp_srcset(self):
+        if not features.check("webp"):
+            return ""
+        return self._srcset("webp")
+
+    @property
+    def jpeg_srcset(self):
+        return self._srcset("jpg")
+
+    @property
+    def src(self):
+        return default_storage.url(variant_name(self.name, WIDTHS[-1], "jpg"))
+
+
+def card_variants(image):
+    """Варианты картинки, если они готовы.
+
+    Возвращает (variants, pending): если вариантов ещё нет, их построение
+    ставится в очередь, и pending=True. Если построить их не удалось,
+    оба значения пустые, и карточка показывает обычную миниатюру.
+    """
+    if not image or thumbnails.has_failed(image.name, generate):
+        return None, False
+    try:
+        ready = default_storage.exists(
+            variant_name(image.name, WIDTHS[-1], "jpg"))
+    except SuspiciousFileOperation:
+        # имя вне хранилища: вариантов у такой картинки не будет
+        return None, False
+    if not ready:
+        if not thumbnails.schedule(image.name, generate):
+            return None, True
+        if thumbnails.has_failed(image.name, generate):
+            return None, False
+    return CardVariants(image.name), False
@@ -1,31 +1,55 @@
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
+from django.views.decorators.http import condition
 
+from . import caching, comments, conditional, search
 from .forms import PostForm, CommentForm
 from .models import Post, Group, User, Follow
+from .page_cache import cache_page_shell, render_shell
+from .pagination import POSTS_PER_PAGE, decode_cursor, paginate
+from .timeline import followed_pull_authors, timeline_posts
 
 
+@condition(etag_func=conditional.index_etag,
+           last_modified_func=conditional.index_last_modified)
+@cache_page_shell(conditional.index_state)
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "index.html", {"page": page,
-                                          "paginator": paginator})
-
-
+    post_list = Post.objects.feed()
+    namespaces = (caching.index_namespace(),)
+    paginator, page = paginate(request, post_list)
+    feed_key = caching.feed_key(request, *namespaces)
+    return render_shell(request, "index.html", {"page": page,
+                                                "paginator": paginator,
+                                                "feed_key": feed_key,
+                                                "feed_timeout": caching.FEED_CACHE_TIMEOUT})
+
+
+@condition(etag_func=conditional.group_etag,
+           last_modified_func=conditional.group_last_modified)
+@cache_page_shell(conditional.group_state)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = Post.objects.filter(group=group).all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"page": page,
-                                          "group": group,
-                                          "paginator": paginator})
+    post_list = Post.objects.feed().filter(group=group)
+    namespaces = (caching.group_namespace(group.pk),)
+    paginator, page = paginate(request, post_list)
+    feed_key = caching.feed_key(request, *namespaces)
+    return render_shell(request, "group.html", {"page": page,
+                                                "group": group,
+                                                "paginator": paginator,
+                                                "feed_key": feed_key,
+                                                "feed_timeout": caching.FEED_CACHE_TIMEOUT})
+
+
+def search_posts(request):
+    query = request.GET.get("q", "").strip()
+    paginator = Paginator(search.search(query), POSTS_PER_PAGE)
+    page = paginator.get_page(request.GET.get("page"))
+    return render_shell(request, "search.html", {"page": page,
+                                                 "paginator": paginator,
+                                                 "query": query})
 
 
 @login_required
@@ -44,27 +68,57 @@ def new_post(request):
                                                       'is_edit': False})
 
 
+@condition(etag_func=conditional.profile_etag,
+           last_modified_func=conditional.profile_last_modified)
+@cache_page_shell(conditional.profile_state)
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    post_list = user.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    is_following = request.user.is_authenticated and request. \
-        user.follower.filter(author=user).exists()
-    return render(request, "profile.html", {"page": page,
-                                            "author": user,
-                                            "paginator": paginator,
-                                            "is_following": is_following})
-
-
+    user = get_object_or_404(User.objects.select_related('stats'),
+                             username=username)
+    post_list = Post.objects.feed().filter(author=user)
+    namespaces = (caching.profile_namespace(user.pk),)
+    paginator, page = paginate(request, post_list)
+    feed_key = caching.feed_key(request, *namespaces)
+    return render_shell(request, "profile.html", {"page": page,
+                                                  "author": user,
+                                                  "paginator": paginator,
+                                                  "feed_key": feed_key,
+                                                  "feed_timeout": caching.FEED_CACHE_TIMEOUT})
+
+
+@condition(etag_func=conditional.post_etag,
+           last_modified_func=conditional.post_last_modified)
+@cache_page_shell(conditional.post_state)
 def post_view(request, username, post_id):
     form = CommentForm()
-    post = get_object_or_404(Post.objects.select_related('author'),
+    post = get_object_or_404(Post.objects.feed()
+                             .select_related('author__stats'),
                              pk=post_id, author__username=username)
-    return render(request, 'post.html', {"post": post,
-                                         "author": post.author,
-                                         "form": form})
+    comment_list, next_cursor = comments.first_page(post)
+    return render_shell(request, 'post.html', {"post": post,
+                                               "author": post.author,
+                                               "form": form,
+                                               "comments": comment_list,
+                                               "next_cursor": next_cursor})
+
+
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев после ?after= - HTML-фрагмент
+    или, с ?format=json, JSON."""
+    modified = Post.objects.filter(pk=post_id, author__username=username) \
+        .values_list("modified", flat=True).first()
+    if modified is None:
+        raise Http404
+    token = request.GET.get("after", "")
+    after = decode_cursor(token) if token else None
+    if request.GET.get("format") == "json":
+        data = comments.cached_page(
+            "json", post_id, modified, token,
+            lambda: comments.page_data(post_id, after))
+        return JsonResponse(data)
+    html = comments.cached_page(
+        "html", post_id, modified, token,
+        lambda: comments.render_page(post_id, username, after))
+    return HttpResponse(html)
 
 
 @login_required
@@ -75,7 +129,10 @@ def post_edit(request, username, post_id):
 
     form = PostForm(request.POST or None, files=request.FILES or None, instance=post)
     if form.is_valid():
-        form.save()
+        # comment_count меняется параллельно, поэтому пишем только поля
+        # формы, версию карточки и время правки
+        form.save(commit=False).save(
+            update_fields=(*form.Meta.fields, 'version', 'modified'))
         return redirect(reverse("post", kwargs={'username': username, 'post_id': post_id}))
 
     return render(request, "includes/new_post.html", {'form': form, 'post': post, 'is_edit': True})
@@ -109,15 +166,22 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.select_related('author'). \
-        filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request,
-                  "follow.html",
-                  {"page": page,
-                   "paginator": paginator})
+    pulled = followed_pull_authors(request.user)
+    post_list = timeline_posts(request.user, pulled)
+    # ленту пересобирают рассылка постов и подписки пользователя, а посты
+    # немногих авторов, читаемых напрямую, - их профили. Карточки не
+    # кешируются во фрагменте ленты: у них свой кеш по версии поста
+    namespaces = (caching.follow_namespace(request.user.pk),
+                  *[caching.profile_namespace(author_id)
+                    for author_id in pulled])
+    paginator, page = paginate(request, post_list)
+    feed_key = caching.feed_key(request, *namespaces)
+    return render_shell(request,
+                        "follow.html",
+                        {"page": page,
+                         "paginator": paginator,
+                         "feed_key": feed_key,
+                         "feed_timeout": caching.FEED_CACHE_TIMEOUT})
 
 
 @login_required
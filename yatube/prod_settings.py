@@ -28,3 +28,35 @@ DATABASES = {
 STATIC_URL = '/static/'
 # задаём адрес директории, куда командой *collectstatic* будет собрана вся статика
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+
+# общий для всех воркеров кеш: по умолчанию файл SQLite на этой машине,
+# при наличии сервера - memcached или redis
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')
+if CACHE_BACKEND == 'memcached':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', '127.0.0.1:11211'),
+        }
+    }
+elif CACHE_BACKEND == 'redis':
+    # требует пакет django-redis
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'yatube.sqlite_cache.SQLiteCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION',
+                                       os.path.join(BASE_DIR, 'cache.sqlite3')),
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+# кеш общий для всех процессов, так что метаданные миниатюр хранятся
+# только в нём, без таблицы thumbnail_kvstore
+THUMBNAIL_KVSTORE = "posts.kvstore.CacheKVStore"
@@ -22,7 +22,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 INSTALLED_APPS = [
     'users',
-    'posts',
+    'posts.apps.PostsConfig',
     'django.contrib.sites',
     'django.contrib.flatpages',
     'django.contrib.admin',
@@ -104,6 +104,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# загрузки пишутся во временный файл, а не держатся в памяти воркера
+FILE_UPLOAD_HANDLERS = [
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+# картинки больше IMAGE_MAX_PIXELS отклоняются, длинная сторона
+# сохраняемого оригинала уменьшается до IMAGE_MAX_SIDE
+IMAGE_MAX_PIXELS = 100_000_000
+# остальные форматы декодируются целиком, для них предел ниже
+IMAGE_MAX_OTHER_PIXELS = 12_000_000
+IMAGE_MAX_SIDE = 2560
 
 # Login
 
@@ -118,12 +128,38 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
+# ленты сбрасываются при изменении постов, TTL лишь страхует от утечек
+FEED_CACHE_TIMEOUT = 300
+# карточка поста в кеше привязана к версии поста и не устаревает сама
+CARD_CACHE_TIMEOUT = 24 * 60 * 60
+# сколько секунд после TTL отдавать старую ленту, пока её пересчитывают
+CACHE_STALE_GRACE = 60
+# страницы кешируются по своему состоянию, TTL лишь освобождает память
+PAGE_CACHE_TIMEOUT = 300
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# сколько постов хранится в материализованной ленте подписок пользователя
+TIMELINE_LENGTH = 1000
+# посты авторов, у которых подписчиков больше порога, не рассылаются по
+# лентам, а подмешиваются при чтении
+TIMELINE_FANOUT_FOLLOWER_LIMIT = 10000
+
+# процессы команды process_images, которая строит миниатюры загруженных
+# картинок (0 - строить в запросе, без очереди)
+THUMBNAIL_WORKERS = 2
+# массовые операции админки выполняет команда process_bulk_jobs
+# (0 - в запросе, без очереди)
+BULK_WORKERS = 1
+# кеш выше локальный для процесса, поэтому метаданные миниатюр хранятся
+# в таблице thumbnail_kvstore с кешем поверх неё; с общим кешем
+# (prod_settings) - только в кеше, posts.kvstore.CacheKVStore
+THUMBNAIL_KVSTORE = "posts.kvstore.CachedDBKVStore"
+
 try:
     from .dev_settings import *
 except ImportError:
@@ -0,0 +1,187 @@
+"""Кеш в файле SQLite, общий для всех воркеров gunicorn на одной машине.
+
+В отличие от LocMemCache запись одного воркера сразу видна остальным,
+поэтому сброс версий пространств имён (posts.caching) работает во всех
+процессах. Целые числа хранятся как INTEGER, и incr() выполняется одним
+UPDATE внутри транзакции, то есть атомарно между процессами.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+"""
+MAX_VARIABLES = 500
+
+
+class SQLiteCache(BaseCache):
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._sets = 0
+
+    def _connection(self):
+        # соединение на поток и на процесс: после fork его нельзя переиспользовать
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _dump(value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "DELETE FROM cache WHERE key = ? AND expires <= ?",
+                (key, time.time()))
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                (key, self._dump(value), self.get_backend_timeout(timeout)))
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (key, time.time())).fetchone()
+        if row is None:
+            return default
+        return self._load(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_key(key, version=version): key for key in keys}
+        for key in keys:
+            self.validate_key(key)
+        found = {}
+        names = list(keys)
+        # старые сборки SQLite ограничивают число параметров запроса
+        for start in range(0, len(names), MAX_VARIABLES):
+            batch = names[start:start + MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection().execute(
+                f"SELECT key, value FROM cache WHERE key IN ({placeholders}) "
+                "AND (expires IS NULL OR expires > ?)",
+                (*batch, time.time()))
+            found.update((keys[key], self._load(value)) for key, value in rows)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((key, self._dump(value), expires))
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires) "
+                "VALUES (?, ?, ?)", rows)
+        self._sets += len(rows)
+        if self._cull_frequency and self._sets >= self._max_entries // 10:
+            self._sets = 0
+            self._cull()
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)",
+                (self.get_backend_timeout(timeout), key, time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, key, time.time()))
+            row = None
+            if cursor.rowcount:
+                row = connection.execute(
+                    "SELECT value FROM cache WHERE key = ?",
+                    (key,)).fetchone()
+        if row is None:
+            raise ValueError("Key '%s' not found" % key)
+        return row[0]
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        connection = self._connection()
+        with connection:
+            connection.executemany("DELETE FROM cache WHERE key = ?",
+                                   [(key,) for key in keys])
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM cache")
+
+    def _cull(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM cache WHERE expires <= ?",
+                               (time.time(),))
+            count = connection.execute(
+                "SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self._max_entries:
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                    "ORDER BY expires IS NULL, expires LIMIT ?)",
+                    (count // self._cull_frequency,))